@@ -0,0 +1,93 @@
+# BENCHMARK
+# Measures the conversion speed of each createTSV script on synthetic ePrime exports (see
+# synthetic_eprime.py), so changes to the conversion code can be compared without the SNAP data.
+# Per-file times are the best of several repeats of convert() on each file; the batch time is the
+# wall time for converting every file across a pool of worker processes, as convert_all does.
+
+from concurrent.futures import ProcessPoolExecutor
+from os.path import basename, join
+import argparse
+import importlib
+import os
+import statistics
+import tempfile
+import time
+import warnings
+
+from convert_all import TASKS, importTasks, runJob
+from synthetic_eprime import EXPORTS, writeExports
+
+
+def timeFile(module, datafile, outputfile, repeat):
+    # best of repeat conversions, which is the least disturbed by other load on the machine
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        module.convert(datafile, outputfile)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchmarkFiles(files, outfolder, repeat):
+    # returns the per-file times (seconds) by task
+    results = {}
+    for task, datafiles in files.items():
+        module = importlib.import_module(TASKS[task])
+        os.makedirs(join(outfolder, task), exist_ok=True)
+        results[task] = [timeFile(module, datafile, join(outfolder, task, basename(datafile) + '.tsv'), repeat)
+                         for datafile in datafiles]
+    return results
+
+
+def benchmarkBatch(files, outfolder, workers):
+    # returns the wall time for converting all files in a pool of worker processes
+    jobs = [(task, (datafile, join(outfolder, task, basename(datafile) + '.tsv')))
+            for task, datafiles in files.items() for datafile in datafiles]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=importTasks, initargs=(list(files),)) as executor:
+        for future in [executor.submit(runJob, task, args) for task, args in jobs]:
+            future.result()
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the createTSV conversions on synthetic ePrime exports.')
+    parser.add_argument('tasks', nargs='*', metavar='task',
+                        help='tasks to benchmark (default: all). One of: ' + ', '.join(sorted(EXPORTS)))
+    parser.add_argument('--subjects', type=int, default=10, help='number of synthetic exports per task')
+    parser.add_argument('--length', type=int, default=1,
+                        help='session length, as a multiple of the trials of a typical session')
+    parser.add_argument('--repeat', type=int, default=3, help='conversions of each file, the best is kept')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes for the batch (default: number of CPUs)')
+    parser.add_argument('--folder', default=None,
+                        help='folder for the exports and converted files (default: a temporary folder)')
+    args = parser.parse_args(argv)
+
+    unknown = [t for t in args.tasks if t not in EXPORTS]
+    if unknown:
+        parser.error('unknown task(s): ' + ', '.join(unknown))
+
+    # pandas warnings from the task scripts would drown the results
+    warnings.simplefilter('ignore')
+
+    with tempfile.TemporaryDirectory() as tmpFolder:
+        folder = args.folder or tmpFolder
+        files = writeExports(join(folder, 'exports'), args.tasks, args.subjects, args.length)
+        outfolder = join(folder, 'converted')
+
+        fileTimes = benchmarkFiles(files, outfolder, args.repeat)
+        batchTime = benchmarkBatch(files, outfolder, args.workers)
+
+    print('{:<10} {:>6} {:>12} {:>12} {:>10}'.format('task', 'files', 'median ms', 'max ms', 'files/s'))
+    for task, times in fileTimes.items():
+        print('{:<10} {:>6} {:>12.1f} {:>12.1f} {:>10.1f}'.format(
+            task, len(times), 1000 * statistics.median(times), 1000 * max(times), len(times) / sum(times)))
+
+    nfiles = sum(len(times) for times in fileTimes.values())
+    print('Batch: {} files in {:.2f} s with {} workers ({:.1f} files/s).'.format(
+        nfiles, batchTime, args.workers, nfiles / batchTime))
+
+
+if __name__ == '__main__':
+    main()
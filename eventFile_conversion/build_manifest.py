@@ -0,0 +1,87 @@
+# BUILD MANIFEST
+# Records what each converted event file was built from so that a re-run can skip subjects whose
+# output is already up to date. An output file is up to date when its source file, the conversion
+# code, and the output file itself all still match what was recorded when it was last converted.
+
+from os.path import abspath, dirname, exists, isfile
+import hashlib
+import json
+import os
+import sys
+import types
+
+
+def fileHash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def converterVersion(module):
+    # hash of a task script and of any modules from the same folder that it uses, directly or through
+    # other such modules (e.g. eprime_io uses build_manifest), so a change to the conversion code
+    # (including shared helpers and their helpers) invalidates everything it converted
+    folder = dirname(abspath(module.__file__))
+    files = set()
+    pending = [module]
+    while pending:
+        current = pending.pop()
+        files.add(abspath(current.__file__))
+        for value in vars(current).values():
+            used = sys.modules.get(getattr(value, '__module__', None), value)
+            usedFile = getattr(used, '__file__', None)
+            if (isinstance(used, types.ModuleType) and usedFile and dirname(abspath(usedFile)) == folder
+                    and abspath(usedFile) not in files):
+                pending.append(used)
+
+    h = hashlib.sha256()
+    for f in sorted(files):
+        h.update(fileHash(f).encode())
+    return h.hexdigest()
+
+
+class Manifest:
+    def __init__(self, manifestFile):
+        self.manifestFile = manifestFile
+        self.entries = {}
+        if exists(manifestFile):
+            with open(manifestFile) as f:
+                self.entries = json.load(f)
+
+    def __stamp(self, path, previous=None):
+        # the recorded hash is reused when size and modification time are unchanged,
+        # so up-to-date files are not read again
+        st = os.stat(path)
+        if previous and previous['size'] == st.st_size and previous['mtime'] == st.st_mtime_ns:
+            return previous
+        return {'size': st.st_size, 'mtime': st.st_mtime_ns, 'hash': fileHash(path)}
+
+    def isCurrent(self, datafile, outputfile, version):
+        entry = self.entries.get(abspath(outputfile))
+        if entry is None or entry['version'] != version:
+            return False
+        if not isfile(datafile) or not isfile(outputfile):
+            return False
+
+        source = self.__stamp(datafile, entry['source'])
+        output = self.__stamp(outputfile, entry['output'])
+        return source['hash'] == entry['source']['hash'] and output['hash'] == entry['output']['hash']
+
+    def record(self, datafile, outputfile, version):
+        # nothing is recorded if the conversion did not produce an output file
+        if isfile(outputfile):
+            self.entries[abspath(outputfile)] = {
+                'datafile': abspath(datafile),
+                'version': version,
+                'source': self.__stamp(datafile),
+                'output': self.__stamp(outputfile),
+            }
+
+    def save(self):
+        # write to a temporary file first so an interrupted run cannot leave a truncated manifest
+        tmpFile = self.manifestFile + '.tmp'
+        with open(tmpFile, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmpFile, self.manifestFile)
@@ -0,0 +1,18 @@
+# COALESCING
+# ePrime writes a measure to a separate column for each procedure that can show the stimulus
+# (e.g. Image.OnsetTime ... Image4.OnsetTime in GoNoGo, or the probe and the jitter following it in
+# DotProbe), and a trial normally has a value in only one of them. coalesce() collapses such a
+# family of columns into one with a single pass over the stacked values.
+
+import numpy as np
+import pandas
+
+
+def coalesce(data):
+    # Returns the first non-missing value of each row, in the order of the columns (missing if
+    # there is none), and a mask of the rows that have a value in more than one column.
+    values = data.to_numpy()
+    present = ~pandas.isna(values)
+    first = values[np.arange(len(values)), present.argmax(axis=1)]
+    multiple = present.sum(axis=1) > 1
+    return pandas.Series(first, index=data.index), pandas.Series(multiple, index=data.index)
@@ -0,0 +1,179 @@
+# ALL TASKS
+# This script runs the createTSV conversion for every task and cohort in a single invocation.
+# The per-subject jobs are built by each task script and spread across a pool of worker processes.
+# Subjects whose output is already up to date (see build_manifest.py) are skipped.
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import isfile
+import argparse
+import importlib
+import json
+import os
+import time
+import warnings
+
+from build_manifest import Manifest, converterVersion, fileHash
+import eprime_io
+from recode import UnmappedValuesWarning
+import stage_timing
+
+# task name -> conversion script
+TASKS = {
+    'cyberball': 'createTSV_Cyberball',
+    'dotprobe': 'createTSV_DotProbe',
+    'driving': 'createTSV_Driving',
+    'emotion': 'createTSV_Emotion',
+    'feedback': 'createTSV_Feedback',
+    'gonogo': 'createTSV_GoNoGo',
+    'team': 'createTSV_Team',
+    'team-pre': 'createTSV_TeamPre',
+    'team-post': 'createTSV_TeamPost',
+}
+
+
+def listJobs(tasks, basefolder=None):
+    # collect the per-subject jobs from each task script, tagged with the task they belong to
+    # without a basefolder each task script uses its own default
+    jobs = []
+    for task in tasks:
+        module = importlib.import_module(TASKS[task])
+        taskJobs = module.listJobs(basefolder) if basefolder else module.listJobs()
+        jobs.extend((task, args) for args in taskJobs)
+    return jobs
+
+
+def importTasks(tasks, cacheFolder=None, chunksize=None):
+    # worker initializer: import the task scripts (and pandas) once per worker process
+    # rather than once per file
+    eprime_io.setCacheFolder(cacheFolder)
+    for task in tasks:
+        module = importlib.import_module(TASKS[task])
+        # task scripts that can read their data files in chunks define CHUNKSIZE
+        if chunksize and hasattr(module, 'CHUNKSIZE'):
+            module.CHUNKSIZE = chunksize
+
+
+def runJob(task, args):
+    # runs in a worker process, where the task script has already been imported
+    # also returns the encoding(s) the source file was read with, the timings of each stage and the
+    # values left unrecoded (see recode.py), which are reported with the file rather than by the worker
+    module = importlib.import_module(TASKS[task])
+    before = Counter(eprime_io.encodingCounts)
+    stage_timing.startTimings()
+    start = time.perf_counter()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always', UnmappedValuesWarning)
+        result = module.convert(*args)
+    timing = {'seconds': time.perf_counter() - start, 'stages': stage_timing.takeTimings()}
+
+    unmapped = []
+    for warning in caught:
+        if issubclass(warning.category, UnmappedValuesWarning):
+            unmapped.append(str(warning.message))
+        else:
+            warnings.showwarning(warning.message, warning.category, warning.filename, warning.lineno)
+    return result, eprime_io.encodingCounts - before, timing, unmapped
+
+
+def jobVersion(version, args, fileHashes):
+    # the version of the task's conversion code plus any extra options given to convert(). Extra
+    # options naming a file (e.g. the DotProbe word pair file) count by their contents, hashed once
+    # per run in fileHashes, so editing that file also converts its subjects again.
+    options = []
+    for arg in args[2:]:
+        if isinstance(arg, str) and isfile(arg):
+            if arg not in fileHashes:
+                fileHashes[arg] = fileHash(arg)
+            arg = fileHashes[arg]
+        options.append(arg)
+    return version + repr(options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert event files for all tasks and cohorts.')
+    parser.add_argument('tasks', nargs='*', metavar='task',
+                        help='tasks to convert (default: all). One of: ' + ', '.join(sorted(TASKS)))
+    parser.add_argument('--basefolder', default=None,
+                        help='folder holding the task data for each cohort and the Converted Files folder '
+                             '(default: the folder set in each task script)')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--manifest', default='conversion_manifest.json',
+                        help='file recording previous conversions, used to skip up-to-date subjects')
+    parser.add_argument('--force', action='store_true', help='convert every file, even if up to date')
+    parser.add_argument('--cache-folder', default=None,
+                        help='folder for caching the parsed source files (requires pyarrow)')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='read data files this many rows at a time, for the tasks that support it (cyberball)')
+    parser.add_argument('--timing-log', default=None,
+                        help='write the time taken by each stage for each file to this JSON-lines file, '
+                             'and print a summary')
+    args = parser.parse_args(argv)
+
+    unknown = [t for t in args.tasks if t not in TASKS]
+    if unknown:
+        parser.error('unknown task(s): ' + ', '.join(unknown))
+
+    if args.cache_folder and eprime_io.pyarrow is None:
+        parser.error('--cache-folder requires pyarrow')
+
+    tasks = args.tasks or sorted(TASKS)
+    manifest = Manifest(args.manifest)
+    allJobs = listJobs(tasks, args.basefolder)
+    # the conversion code is hashed once per task, not for every job
+    versions = {task: converterVersion(importlib.import_module(TASKS[task])) for task in tasks}
+    fileHashes = {}
+    jobVersions = [jobVersion(versions[task], jobArgs, fileHashes) for task, jobArgs in allJobs]
+    jobs = [(task, jobArgs, version) for (task, jobArgs), version in zip(allJobs, jobVersions)
+            if args.force or not manifest.isCurrent(jobArgs[0], jobArgs[1], version)]
+    print(f'Skipping {len(allJobs) - len(jobs)} up-to-date files.')
+    print(f'Converting {len(jobs)} files for {len(tasks)} tasks using {args.workers} workers.')
+
+    results = {task: [] for task in tasks}
+    encodings = Counter()
+    timings = []
+    failures = []
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=importTasks,
+                                 initargs=(tasks, args.cache_folder, args.chunksize)) as executor:
+            futures = {executor.submit(runJob, task, jobArgs): (task, jobArgs, version)
+                       for task, jobArgs, version in jobs}
+            for future in as_completed(futures):
+                task, jobArgs, version = futures[future]
+                datafile, outputfile = jobArgs[:2]
+                try:
+                    result, used, timing, unmapped = future.result()
+                    for message in unmapped:
+                        print(f'WARNING: {task}: {datafile}: {message}')
+                    results[task].append((datafile, result))
+                    encodings.update(used)
+                    timings.append({'task': task, 'datafile': datafile, **timing})
+                    manifest.record(datafile, outputfile, version)
+                except Exception as e:
+                    failures.append(datafile)
+                    print(f'FAILED: {task}: {datafile}: {e}')
+    finally:
+        # keep what was converted so far even if the run is interrupted
+        manifest.save()
+
+    # task scripts may summarize QC info across all of their files
+    for task in tasks:
+        module = importlib.import_module(TASKS[task])
+        if hasattr(module, 'report'):
+            module.report(results[task])
+
+    if args.timing_log:
+        with open(args.timing_log, 'w') as f:
+            for timing in timings:
+                f.write(json.dumps(timing) + '\n')
+        print('\n'.join(stage_timing.summarize(timings)))
+
+    print(f'Converted {len(jobs) - len(failures)} of {len(jobs)} files.')
+    if encodings:
+        print('Encodings read: ' + ', '.join(f'{e}: {n}' for e, n in sorted(encodings.items())))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -3,18 +3,27 @@
 # Only data deemed relevant for analysis have been retained, however this has been construed broadly.
 
 from os import listdir
-from os.path import isfile, join
+from os.path import basename, dirname, isfile, join
+import argparse
+import itertools
 import re
 import numpy as np
 import pandas
 
+from eprime_io import readMatchingColumns, readMatchingColumnsChunked
+from frame_assembly import ColumnCollector
+from recode import recode
+from stage_timing import timed
+
 # turning off a warning that occurs with some chained commands.
 pandas.options.mode.chained_assignment = None
 
 class Data:
-    def __init__(self, dataFileName):
+    def __init__(self, dataFileName, chunksize=None):
         self.contents = None
         self.dataFile = dataFileName
+        self.chunksize = chunksize # rows read at a time, or None to read the whole file at once
+        self.encoding = None
         self.stimuli = [HereWeGo(), Rest(), Decision(), Throw()]
         self.readFields = self.__declareReadFields()
         self.writeFields = self.__declareWriteFields()
@@ -36,29 +45,40 @@ class Data:
                        'throw_pattern', 'image_number', 'filenames', 'image_durations']
         return writeFields
 
+    @timed
     def load(self):
         # Note that some headers must be specified as a regex.
-        p = '|'.join(self.readFields)
-        pattern = re.compile(p)
+        # These are matched against the header line, and only the matching columns are parsed.
         try:
-            headers = pandas.read_csv(self.dataFile, sep='\t', index_col=0, nrows=0).columns.tolist()
-            self.readFields = [s for s in headers if pattern.match(s)]
-            self.contents = pandas.read_csv(self.dataFile, sep='\t', usecols=self.readFields)
+            if self.chunksize:
+                # the rows are only read as they are cleaned (see clean)
+                self.contents, self.readFields, self.encoding = readMatchingColumnsChunked(
+                    self.dataFile, self.readFields, self.chunksize)
+            else:
+                self.contents, self.encoding = readMatchingColumns(self.dataFile, self.readFields)
+                self.readFields = self.contents.columns.tolist()
         except:
-            try:  # if defaults didn't work, try reading with an alternate encoding
-                headers = pandas.read_csv(self.dataFile, sep='\t', index_col=0, nrows=0, encoding='utf_16_le').columns.tolist()
-                self.readFields = [s for s in headers if pattern.match(s)]
-                self.contents = pandas.read_csv(self.dataFile, sep='\t', usecols=self.readFields, encoding='utf_16_le')
-            except:
-                raise Exception('Unable to load {}'.format(self.dataFile))
+            raise Exception('Unable to load {}'.format(self.dataFile))
 
+    @timed
     def clean(self):
-        cleanedData = pandas.DataFrame(columns=self.writeFields)
+        collector = ColumnCollector(self.writeFields)
 
         # go through each stimuli type and reorganize data belonging to this type
-        for stimType in self.stimuli:
-            stimData = stimType.clean(self.contents, self.writeFields)
-            cleanedData = pandas.concat([cleanedData, stimData])
+        if self.chunksize:
+            # only the throws use more than the first row of the file, so the other stimuli are
+            # cleaned from the first chunk and the throws from every chunk as it is read
+            chunks = iter(self.contents)
+            firstChunk = next(chunks)
+            for stimType in self.stimuli:
+                if hasattr(stimType, 'cleanChunks'):
+                    collector.add(stimType.cleanChunks(itertools.chain([firstChunk], chunks), self.writeFields))
+                else:
+                    collector.add(stimType.clean(firstChunk, self.writeFields))
+        else:
+            for stimType in self.stimuli:
+                collector.add(stimType.clean(self.contents, self.writeFields))
+        cleanedData = collector.assemble()
 
         # convert units from millisecond to seconds
         cols = ['onset', 'duration', 'reaction_time', 'reaction_scantime']
@@ -101,6 +121,7 @@ class Data:
 
         self.contents = cleanedData
 
+    @timed
     def __removeGhostEvents(self, data):
         data = data.reset_index(drop=True)
 
@@ -138,6 +159,7 @@ class Data:
 
         return data
 
+    @timed
     def __validateThrowSequences(self, data):
         is_boundary = data['trial_type'].isin(['Rest', 'HereWeGo'])
         round_id = is_boundary.cumsum()
@@ -156,6 +178,7 @@ class Data:
             if len(rnd) < 2 or mismatches.any():
                 self.qc_flags['out_of_sequence_throws'] = True
 
+    @timed
     def __addClusivity(self, data):
         data = data.reset_index(drop=True) # don't count on this being done before now.
 
@@ -187,6 +210,7 @@ class Data:
 
         return data
 
+    @timed
     def write(self, outputfile):
         if self.contents is not None:
             self.contents.to_csv(outputfile, sep='\t', float_format='%.3f', na_rep='n/a', index=False)
@@ -217,6 +241,7 @@ class HereWeGo:
                               'getready2.OnsetTime', 'getready2.OffsetTime']
         self.inputFields = list(set(self.onsetField + self.durationField))
 
+    @timed
     def clean(self, rawData, outputFields):
         # extract onset time
         try:
@@ -279,6 +304,7 @@ class Rest:
                               'rest4.OnsetTime', 'rest4.OffsetTime']
         self.inputFields = list(set(self.onsetField + self.durationField))
 
+    @timed
     def clean(self, rawData, outputFields):
         # extract onset time
         try:
@@ -367,6 +393,7 @@ class Decision:
                                     + self.reaction_timeField + self.reaction_scantimeField
                                     + self.image_numberField))
 
+    @timed
     def clean(self, rawData, outputFields):
         # raw data must be extracted across matching column headers for each row of converted data
         pattern = '|'.join(self.onsetField)
@@ -413,7 +440,7 @@ class Decision:
         # recode response
         response = pandas.DataFrame(response, columns=['response'], dtype=str)
         responseRecodeVals = {'2': 'right', '7': 'left', 'nan': 'n/a'}
-        response = response.replace({'response': responseRecodeVals})
+        response = recode(response, {'response': responseRecodeVals})
 
         no_response = (response['response'] == 'n/a')
         reaction_time = pandas.DataFrame(reaction_time, columns=['reaction_time'], dtype=pandas.Int64Dtype())
@@ -469,6 +496,7 @@ class Throw:
                                     + self.throwerField + self.catcherField + self.blockField
                                     + self.throw_patternField + self.filenamesField + self.image_durationsField))
 
+    @timed
     def clean(self, rawData, outputFields):
         # data for all throw events are within the same columns
         # must parse filenames column to identify individual events
@@ -502,14 +530,14 @@ class Throw:
         thrower = thrower.str.replace(r'to\d\.\d\.bmp', '', regex=True)
         thrower = thrower.reset_index(drop=True).to_frame('thrower')
         throwerRecodeVals = {'1': 'player1', '2': 'subject', '3': 'player3'}
-        thrower = thrower.replace({'thrower': throwerRecodeVals})
+        thrower = recode(thrower, {'thrower': throwerRecodeVals})
 
         # extract catcher and recode
         catcher = rawData['filename'].loc[eventStart]
         catcher = catcher.str.replace(r'\dto', '', regex=True).str.replace(r'\.\d\.bmp', '', regex=True)
         catcher = catcher.reset_index(drop=True).to_frame('catcher')
         catcherRecodeVals = {'1': 'player1', '2': 'subject', '3': 'player3'}
-        catcher = catcher.replace({'catcher': catcherRecodeVals})
+        catcher = recode(catcher, {'catcher': catcherRecodeVals})
 
         # extract block
         block = rawData[self.blockField].loc[eventStart]
@@ -522,31 +550,18 @@ class Throw:
         throw_pattern = throw_pattern.reset_index(drop=True).rename(columns={throw_pattern.columns[0]: 'throw_pattern'}).astype(str)
 
         # Collect all filenames and image durations for each throw event into single entries.
-        filenames = []
-        image_durations = []
+        # Rows are grouped by event using the running count of event starts.
+        eventID = eventStart.cumsum()
+        # some values missing in SNAP 2 data (last throw in sub-01008 specifically)
+        fnames = '\'' + rawData['filename'].fillna('n/a') + '\''
         imgdurs = rawData['MyImageDisplay.OffsetTime'] - rawData['MyImageDisplay.OnsetTime']
         imgdurs = imgdurs/1000 # convert from millisecond to seconds
-        for i, (fname, imgdur) in enumerate(zip(rawData['filename'], imgdurs)):
-            # some values missing in SNAP 2 data (last throw in sub-01008 specifically)
-            if pandas.isnull(fname): fname = 'n/a'
-            if pandas.isnull(imgdur): imgdur = 'n/a'
-
-            if eventStart[i]:
-                if eventEnd[i]:  # for single image throw events where the start is also the end
-                    filenames.append('[\'' + fname + '\']')
-                    image_durations.append('[' + str(imgdur) + ']')
-                else:
-                    filestr = '[\'' + fname + '\', '
-                    durstr = '[' + str(imgdur) + ', '
-            elif eventEnd[i]:
-                filenames.append(filestr + '\'' + fname + '\']')
-                image_durations.append(durstr + str(imgdur) + ']')
-            else:
-                filestr = filestr + '\'' + fname + '\', '
-                durstr = durstr + str(imgdur) + ', '
+        imgdurs = imgdurs.astype(str).mask(imgdurs.isnull(), 'n/a')
 
-        filenames = pandas.DataFrame(filenames, columns=['filenames'], dtype=str)
-        image_durations = pandas.DataFrame(image_durations, columns=['image_durations'], dtype=str)
+        filenames = '[' + fnames.groupby(eventID).agg(', '.join) + ']'
+        filenames = filenames.reset_index(drop=True).to_frame('filenames')
+        image_durations = '[' + imgdurs.groupby(eventID).agg(', '.join) + ']'
+        image_durations = image_durations.reset_index(drop=True).to_frame('image_durations')
 
         data = pandas.concat([onset, duration, thrower, catcher, block,
                               throw_pattern, filenames, image_durations], axis=1)
@@ -560,66 +575,75 @@ class Throw:
 
         return data
 
+    def cleanChunks(self, chunks, outputFields):
+        # Cleans the rows a chunk at a time. The last throw event of a chunk may continue in the
+        # next chunk, so its rows are carried over and cleaned together with that chunk.
+        cleaned = []
+        carry = None
+        for chunk in chunks:
+            if carry is not None:
+                chunk = pandas.concat([carry, chunk])
+            names = chunk['filename'].astype(object).str.replace(r'\.\d\.bmp', '', regex=True)
+            lastStart = np.flatnonzero((names != names.shift(periods=1)).to_numpy())[-1]
+            if lastStart > 0:
+                cleaned.append(self.clean(chunk.iloc[:lastStart], outputFields))
+            carry = chunk.iloc[lastStart:]
+
+        if carry is not None:
+            cleaned.append(self.clean(carry, outputFields))
+        data = pandas.concat(cleaned, ignore_index=True)
+
+        # clean() checks the order of onsets within each chunk, this checks it across chunks
+        assert data['onset'].dropna().is_monotonic_increasing, (
+            f'[ClassName: {self.__class__.__name__}] Data Integrity Error: '
+            'Unsorted onsets across chunks of rawData.')
+
+        return data
+
 # path to data
+# default location of the data, which can be changed with --basefolder.
+# all other folders are relative to this one.
 basefolder = '/g/Imaging/SNAP/Data/Task Behavioral Data for BIDS/'
-snap1datadir = basefolder + 'SNAP 1/Cyberball (Catch)/'
-snap2datadir = basefolder + 'SNAP 2/Cyberball (Catch)/'
-snap3datadir = basefolder + 'SNAP 3/Cyberball (Catch)/'
+snap1datadir = 'SNAP 1/Cyberball (Catch)/'
+snap2datadir = 'SNAP 2/Cyberball (Catch)/'
+snap3datadir = 'SNAP 3/Cyberball (Catch)/'
 snapdatadir = [snap1datadir, snap2datadir, snap3datadir]
 
-# getting list of files
-snap1files = [f for f in listdir(snap1datadir) if isfile(join(snap1datadir, f))]
-snap2files = [f for f in listdir(snap2datadir) if isfile(join(snap2datadir, f))]
-snap3files = [f for f in listdir(snap3datadir) if isfile(join(snap3datadir, f))]
-snapfiles = [snap1files, snap2files, snap3files]
-
 # output folder
-snap1outdir = basefolder + 'Converted Files/SNAP 1/Cyberball/'
-snap2outdir = basefolder + 'Converted Files/SNAP 2/Cyberball/'
-snap3outdir = basefolder + 'Converted Files/SNAP 3/Cyberball/'
+snap1outdir = 'Converted Files/SNAP 1/Cyberball/'
+snap2outdir = 'Converted Files/SNAP 2/Cyberball/'
+snap3outdir = 'Converted Files/SNAP 3/Cyberball/'
 snapoutdir = [snap1outdir, snap2outdir, snap3outdir]
 
 VERBOSE = False # Toggle printing some logging info about malformed data to stdout.
+CHUNKSIZE = None # Rows of a data file read at a time, to bound memory use. None reads whole files.
 
-# read, clean, and write data
-seenIDs = []
-for datadir, files, outdir in zip(snapdatadir, snapfiles, snapoutdir):
-    files_with_throw_ghosts = 0 # tracking a problem that seems pervasive (see QC document)
-    for datafilename in files:
-        thisData = Data(join(datadir, datafilename))
 
-        # create the output file name
-        # - A handful of subjects have scans that were rerun for various reasons.
-        # - These have the string run-01, run-02, etc. added to the event files
-        # - to distinguish which file belongs to which run.
-        pattern = r'run-(\d+)'
-        match = re.search(pattern, datafilename)
-        runID = match.group(1) if match else '1'
+def subjectRun(datafilename):
+    # - A handful of subjects have scans that were rerun for various reasons.
+    # - These have the string run-01, run-02, etc. added to the event files
+    # - to distinguish which file belongs to which run.
+    pattern = r'run-(\d+)'
+    match = re.search(pattern, datafilename)
+    runID = match.group(1) if match else '1'
 
-        # extract ID from whatever numbers are left after removing run.
-        strippedName = re.sub(pattern, "", datafilename)
-        subjID = str(''.join(filter(str.isdigit, strippedName)))
+    # extract ID from whatever numbers are left after removing run.
+    strippedName = re.sub(pattern, "", datafilename)
+    subjID = str(''.join(filter(str.isdigit, strippedName)))
 
-        outputfile = ('sub-' + subjID.zfill(5) + '_task-cyberball_run-'
-                                                + runID + '_events.tsv')
+    return subjID, runID
 
-        try:
-            thisData.load()
-            thisData.clean()
-
-            if VERBOSE:
-                # tracking some quality control info about malformed data.
-                if thisData.qc_flags['ghost_throws']:
-                    files_with_throw_ghosts += 1
-                if thisData.qc_flags['ghost_decisions']:
-                    print(f'Malformed Data: sub-{subjID} run-{runID}: ghost decisions')
-                if thisData.qc_flags['out_of_sequence_throws']:
-                    print(f'Malformed Data: sub-{subjID} run-{runID}: out of sequence throws')
-
-                # checking if previous onset+duration is falling far short of the recorded onset of the next event
-                expected = thisData.contents['onset'].shift() + thisData.contents['duration'].shift()
-                if ((thisData.contents['onset'] - expected).abs() > 1).iloc[1:].any():
-                    print(f'  WARNING: sub-{subjID} run-{runID}: onset gap > 1s detected')
+
+def listJobs(basefolder=basefolder):
+    # pair every data file with its output file across all cohorts
+    jobs = []
+    seenIDs = []
+    for datadir, outdir in zip(snapdatadir, snapoutdir):
+        datadir = join(basefolder, datadir)
+        outdir = join(basefolder, outdir)
+        files = [f for f in listdir(datadir) if isfile(join(datadir, f))]
+        for datafilename in files:
+            subjID, runID = subjectRun(datafilename)
 
             if subjID + runID in seenIDs:
                 # making sure there is no duplicate file as this would silently overwrite output from the first file
@@ -627,11 +651,73 @@ for datadir, files, outdir in zip(snapdatadir, snapfiles, snapoutdir):
             else:
                 seenIDs.append(subjID + runID)
 
-            thisData.write(join(outdir, outputfile))
-        except:
-            raise Exception(f'Unable to process subject {subjID}, run {runID}')
+            outputfile = ('sub-' + subjID.zfill(5) + '_task-cyberball_run-'
+                                                    + runID + '_events.tsv')
+
+            jobs.append((join(datadir, datafilename), join(outdir, outputfile)))
+
+    return jobs
+
 
+def convert(datafile, outputfile):
+    # read, clean, and write data for a single subject
+    subjID, runID = subjectRun(basename(datafile))
+    thisData = Data(datafile, chunksize=CHUNKSIZE)
+
+    try:
+        thisData.load()
+        thisData.clean()
+
+        if VERBOSE:
+            # tracking some quality control info about malformed data.
+            if thisData.qc_flags['ghost_decisions']:
+                print(f'Malformed Data: sub-{subjID} run-{runID}: ghost decisions')
+            if thisData.qc_flags['out_of_sequence_throws']:
+                print(f'Malformed Data: sub-{subjID} run-{runID}: out of sequence throws')
+
+            # checking if previous onset+duration is falling far short of the recorded onset of the next event
+            expected = thisData.contents['onset'].shift() + thisData.contents['duration'].shift()
+            if ((thisData.contents['onset'] - expected).abs() > 1).iloc[1:].any():
+                print(f'  WARNING: sub-{subjID} run-{runID}: onset gap > 1s detected')
+
+        thisData.write(outputfile)
+    except:
+        raise Exception(f'Unable to process subject {subjID}, run {runID}')
+
+    return thisData.qc_flags
+
+
+def report(results):
+    # printing some QC info about malformed data
+    # results are (datafile, qc_flags) pairs as returned from convert()
     if VERBOSE:
-        # printing some QC info about malformed data
-        if files_with_throw_ghosts == len(files):
-            print(f'All files in {datadir} contained ghost throw events.')
\ No newline at end of file
+        for datadir in sorted(set(dirname(datafile) for datafile, qc_flags in results)):
+            flags = [qc_flags for datafile, qc_flags in results if dirname(datafile) == datadir]
+            files_with_throw_ghosts = sum(f['ghost_throws'] for f in flags) # tracking a problem that seems pervasive (see QC document)
+            if files_with_throw_ghosts == len(flags):
+                print(f'All files in {datadir} contained ghost throw events.')
+
+
+def main(argv=None):
+    global VERBOSE, CHUNKSIZE
+
+    parser = argparse.ArgumentParser(description='Convert Cyberball event files to BIDS tsv files.')
+    parser.add_argument('--basefolder', default=basefolder,
+                        help='folder holding the task data for each cohort and the Converted Files folder')
+    parser.add_argument('--verbose', action='store_true', help='print info about malformed data')
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE,
+                        help='read the data files this many rows at a time to limit memory use')
+    args = parser.parse_args(argv)
+    VERBOSE = VERBOSE or args.verbose
+    CHUNKSIZE = args.chunksize
+
+    # read, clean, and write data
+    results = []
+    for datafile, outputfile in listJobs(args.basefolder):
+        results.append((datafile, convert(datafile, outputfile)))
+
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
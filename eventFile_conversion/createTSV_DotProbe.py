@@ -3,10 +3,18 @@
 # Only data deemed relevant for analysis have been retained, however this has been construed broadly.
 
 from os import listdir
-from os.path import isfile, join, exists
+from os.path import basename, isfile, join, exists
+import argparse
 import numpy as np
 import pandas
 
+from coalesce import coalesce
+from eprime_io import readColumns
+from frame_assembly import ColumnCollector
+from recode import recode
+from reference_data import loadTable, registerTable
+from stage_timing import timed
+
 # turning off a warning that occurs with some chained commands.
 pandas.options.mode.chained_assignment = None
 
@@ -22,6 +30,7 @@ class Data:
 
         self.contents = None
         self.dataFile = dataFileName
+        self.encoding = None
         self.stimuli = [Probe(error_data=self.errorCheckData)]
         self.readFields = self.__declareReadFields()
         self.writeFields = self.__declareWriteFields()
@@ -39,44 +48,54 @@ class Data:
         return writeFields
 
     def __loadErrorData(self):
-        assert exists('dotprobe-wordpairs.csv'), (
+        assert exists(self.errorFileName), (
             f"The file {self.errorFileName} required for extra error checking is missing. "
             "See ./dotprobe-wordpairs-example.csv for how to construct this file. "
             "Original file intentionally excluded for public sharing of code. "
             "You may request this file if needed for reproducibility.")
 
-        return pandas.read_csv(self.errorFileName, sep='\t')
+        # the word pair file is the same for every subject, so its index is shared (see reference_data.py)
+        return loadTable('dotprobe-wordpairs', self.errorFileName)
 
+    @timed
     def load(self):
-        # These try-except blocks have been tailored to the particular data files being parsed in order to accommodate
-        # the different encodings that were encountered
         try:
-            self.contents = pandas.read_csv(self.dataFile, sep='\t', usecols=self.readFields)
+            self.contents, self.encoding = readColumns(self.dataFile, self.readFields)
         except:
-            try: # if defaults didn't work, try reading with an alternate encoding
-                self.contents = pandas.read_csv(self.dataFile, sep='\t', usecols=self.readFields, encoding='utf_16_le')
-            except:
-                raise Exception('Unable to load {}'.format(self.dataFile))
+            raise Exception('Unable to load {}'.format(self.dataFile))
 
+    @timed
     def clean(self):
-        cleanedData = pandas.DataFrame(columns=self.writeFields)
+        collector = ColumnCollector(self.writeFields)
 
         # go through each stimuli type and reorganize data belonging to this type
         for stimType in self.stimuli:
-            stimData = stimType.clean(self.contents, self.writeFields)
-            cleanedData = pandas.concat([cleanedData, stimData])
-
-        # replace all nan with 'NA'
-        cleanedData.replace(np.nan, 'NA', inplace=True)
+            collector.add(stimType.clean(self.contents, self.writeFields))
+        cleanedData = collector.assemble()
 
         # sort by onset time
         cleanedData.sort_values(by='onset', inplace=True)
 
         self.contents = cleanedData
 
+    @timed
     def write(self, outputfile):
         if self.contents is not None:
-            self.contents.to_csv(outputfile, sep='\t', index=False)
+            # missing values are written as 'NA', so the columns can keep their numeric types until here
+            self.contents.to_csv(outputfile, sep='\t', na_rep='NA', index=False)
+
+
+def wordPairIndex(errorFileName):
+    # maps each word pair (in either order) to the set of valences it may be labelled with
+    wordPairs = pandas.read_csv(errorFileName, sep='\t')
+    index = {}
+    for word1, word2, valence in zip(wordPairs['word1'], wordPairs['word2'], wordPairs['valence']):
+        index.setdefault(frozenset((word1, word2)), set()).add(valence)
+    return index
+
+
+# word pair index for the optional error checking
+registerTable('dotprobe-wordpairs', wordPairIndex)
 
 
 # specific types of stimuli in the task
@@ -137,21 +156,22 @@ class Probe:
         if dataName == 'trial_type' and self.error_data is not None:
             # Verify that the recorded word pairs match the preselected word pair list, then
             # verify that the recorded trial_type matches the expected trial_type for each word pair
-            allowed_trials = self.error_data
-            for index, row in data.iterrows():
-                wordR_trials = allowed_trials.loc[(allowed_trials['word1'] == row['wordR']) |
-                                                  (allowed_trials['word2'] == row['wordR'])]
-                bothWord_trials = wordR_trials.loc[(wordR_trials['word1'] == row['wordL']) |
-                                                   (wordR_trials['word2'] == row['wordL'])]
-
-                wordpair = ' '.join(row[['wordR', 'wordL']].values.tolist())
-
-                if bothWord_trials.empty:
-                    raise Exception('Word pair ({}) not found in list of expected word pairs'.format(wordpair))
-
-                if not (bothWord_trials['valence'] == row['trial_type']).any():
-                    raise Exception('Valence (i.e. trial_type) of word pair ({}) does not match expected valence'.format(wordpair))
-
+            # word pairs are looked up irrespective of which side each word was shown on
+            pairs = pandas.Series([frozenset(pair) for pair in zip(data['wordR'], data['wordL'])], index=data.index)
+            allowed = pairs.map(self.error_data)
+            wordpairs = data['wordR'].astype(str) + ' ' + data['wordL'].astype(str)
+
+            unknown = allowed.isnull()
+            if unknown.any():
+                raise Exception('Word pair(s) ({}) not found in list of expected word pairs'.format(
+                    ', '.join(wordpairs[unknown].unique())))
+
+            matched = pandas.Series([t in a for t, a in zip(data['trial_type'], allowed)], index=data.index)
+            if not matched.all():
+                raise Exception('Valence (i.e. trial_type) of word pair(s) ({}) does not match expected valence'.format(
+                    ', '.join(wordpairs[~matched].unique())))
+
+    @timed
     def clean(self, rawData, outputFields):
         # combine onset data into one column
         onset = rawData['Words.OnsetTime'] - rawData['GetReady.OnsetTime']
@@ -167,7 +187,7 @@ class Probe:
         reaction_time = rawData[self.reaction_timeField]
         reaction_time['Prb.RT'] = reaction_time['Prb.RT'].replace(0, np.NaN) # no response made during probe
         reaction_time['jitter.RT'] = reaction_time['jitter.RT'] + 500 # 0 during jitter sometimes has a response with it
-        reaction_time = reaction_time['Prb.RT'].fillna(reaction_time['jitter.RT']) # replace missing probe with jitter
+        reaction_time, _ = coalesce(reaction_time[['Prb.RT', 'jitter.RT']]) # replace missing probe with jitter
         response = rawData[self.responseField]
         noRespTrials = response.index[response.isnull().all(1)]  # trials with no response in probe or jitter
         reaction_time.loc[noRespTrials] = np.NaN # filtering out 0 reaction time in jitter when there was no response
@@ -183,10 +203,9 @@ class Probe:
         # expected numbers 2 and 7. Code for the task was unavailable for review, so it is being
         # assumed for now that the best explanation is that this participant had their fingers
         # moved over one button on the button box and this is recoded accordingly.
-        response = rawData[self.responseField]
-        response = response['Prb.RESP'].fillna(response['jitter.RESP'])
+        response, _ = coalesce(rawData[['Prb.RESP', 'jitter.RESP']])
         responseRecodeVals = {2: "right", 7: "left", 3: "right", 8: "left"}
-        response = response.to_frame('response').replace({'response': responseRecodeVals})
+        response = recode(response.to_frame('response'), {'response': responseRecodeVals})
 
         self.error_check('response', pandas.concat([response, reaction_time, reaction_scantime], axis=1))
 
@@ -194,10 +213,11 @@ class Probe:
         probe_rl = rawData[self.probe_rlField]
         probe_rlDecodVals = {"r": "right", "l": "left"}
         probe_rl = probe_rl.rename(columns={probe_rl.columns[0]: 'probe_rl'})
-        probe_rl = probe_rl.replace({'probe_rl': probe_rlDecodVals})
+        probe_rl = recode(probe_rl, {'probe_rl': probe_rlDecodVals})
 
         # calculate accuracy
-        correct = response['response'] == probe_rl['probe_rl']
+        # compared as plain values, since the two recoded columns need not have the same categories
+        correct = response['response'].astype(object) == probe_rl['probe_rl'].astype(object)
         accuracy = correct.to_frame('accuracy')
         accuracy = accuracy.where(correct, other="incorrect")
         accuracy = accuracy.where(~correct, other="correct")
@@ -207,13 +227,13 @@ class Probe:
         word_rl = rawData[self.word_rlField]
         word_rlDecodeVals = {"r": "right", "l": "left"}
         word_rl = word_rl.rename(columns={word_rl.columns[0]: 'word_rl'})
-        word_rl = word_rl.replace({'word_rl': word_rlDecodeVals})
+        word_rl = recode(word_rl, {'word_rl': word_rlDecodeVals})
 
         # recode congruency
         congruency = rawData[self.congruencyField]
         congruencyDecodeVals = {"i": "incongruent", "c": "congruent"}
         congruency = congruency.rename(columns={congruency.columns[0]: 'congruency'})
-        congruency = congruency.replace({'congruency': congruencyDecodeVals})
+        congruency = recode(congruency, {'congruency': congruencyDecodeVals})
 
         # combine word onset data into one column
         word_onset = rawData['Words.OnsetTime'] - rawData['GetReady.OnsetTime']
@@ -272,85 +292,82 @@ class Probe:
 
 
 # path to data
+# default location of the data, which can be changed with --basefolder.
+# all other folders are relative to this one.
 basefolder = "/mnt/magaj/SNAP/Data/Task Behavioral Data for BIDS/"
-snap1datadir = basefolder + "SNAP 1/Dot Probe (Dot or Star)/"
-snap2datadir = basefolder + "SNAP 2/DotProbe (Star or Dot)/"
-snap3datadir = basefolder + "SNAP 3/DotProbe (Star or Dot)/"
-
-# getting list of files
-snap1files = [f for f in listdir(snap1datadir) if isfile(join(snap1datadir, f))]
-snap2files = [f for f in listdir(snap2datadir) if isfile(join(snap2datadir, f))]
-snap3files = [f for f in listdir(snap3datadir) if isfile(join(snap3datadir, f))]
+snap1datadir = "SNAP 1/Dot Probe (Dot or Star)/"
+snap2datadir = "SNAP 2/DotProbe (Star or Dot)/"
+snap3datadir = "SNAP 3/DotProbe (Star or Dot)/"
 
 # output folder
-snap1outdir = basefolder + "Converted Files/SNAP 1/DotProbe/"
-snap2outdir = basefolder + "Converted Files/SNAP 2/DotProbe/"
-snap3outdir = basefolder + "Converted Files/SNAP 3/DotProbe/"
+snap1outdir = "Converted Files/SNAP 1/DotProbe/"
+snap2outdir = "Converted Files/SNAP 2/DotProbe/"
+snap3outdir = "Converted Files/SNAP 3/DotProbe/"
 
 
 # optional file for additional error checking.
 # checks for correct valence label for a given word pair.
-# switch to commented code if you wish use.
+# switch to commented code (or pass --error-file) if you wish use.
 errorFileName = None
 #errorFileName = './dotprobe-wordpairs.csv'
 
 
-# read, clean, and write data
-seenIDs = []
-for datafile in snap1files:
-    thisData = Data(join(snap1datadir, datafile), errorFileName)
-    subjID = str(''.join(filter(str.isdigit, datafile)))
 
-    try:
-        thisData.load()
-        thisData.clean()
+def subjectID(datafile):
+    return str(''.join(filter(str.isdigit, datafile)))
 
-        if subjID in seenIDs:
-            # making sure there is no duplicate file as this would silently overwrite output from the first file
-            raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
-        else:
-            seenIDs.append(subjID)
-            outputfile = "sub-" + subjID.zfill(5) + "_task-dotprobe_run01_events.tsv"
 
-        thisData.write(join(snap1outdir, outputfile))
-    except:
-        raise Exception('Unable to process subject {}'.format(subjID))
+def listJobs(basefolder=basefolder, errorFileName=errorFileName):
+    # pair every data file with its output file across all cohorts
+    # the optional error checking is only applied to SNAP 1
+    jobs = []
+    for datadir, outdir, errorFile in [(snap1datadir, snap1outdir, errorFileName),
+                                       (snap2datadir, snap2outdir, None),
+                                       (snap3datadir, snap3outdir, None)]:
+        seenIDs = []
+        datadir = join(basefolder, datadir)
+        outdir = join(basefolder, outdir)
+        files = [f for f in listdir(datadir) if isfile(join(datadir, f))]
+        for datafile in files:
+            subjID = subjectID(datafile)
 
-seenIDs = []
-for datafile in snap2files:
-    thisData = Data(join(snap2datadir, datafile))
-    subjID = str(''.join(filter(str.isdigit, datafile)))
+            if subjID in seenIDs:
+                # making sure there is no duplicate file as this would silently overwrite output from the first file
+                raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
+            else:
+                seenIDs.append(subjID)
+                outputfile = "sub-" + subjID.zfill(5) + "_task-dotprobe_run01_events.tsv"
 
-    try:
-        thisData.load()
-        thisData.clean()
+            jobs.append((join(datadir, datafile), join(outdir, outputfile), errorFile))
 
-        if subjID in seenIDs:
-            # making sure there is no duplicate file as this would silently overwrite output from the first file
-            raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
-        else:
-            seenIDs.append(subjID)
-            outputfile = "sub-" + subjID.zfill(5) + "_task-dotprobe_run01_events.tsv"
+    return jobs
 
-        thisData.write(join(snap2outdir, outputfile))
-    except:
-        raise Exception('Unable to process subject {}'.format(subjID))
 
-seenIDs = []
-for datafile in snap3files:
-    thisData = Data(join(snap3datadir, datafile))
-    subjID = str(''.join(filter(str.isdigit, datafile)))
+def convert(datafile, outputfile, errorFileName=None):
+    # read, clean, and write data for a single subject
+    thisData = Data(datafile, errorFileName)
+    subjID = subjectID(basename(datafile))
 
     try:
         thisData.load()
         thisData.clean()
+        thisData.write(outputfile)
+    except:
+        raise Exception('Unable to process subject {}'.format(subjID))
 
-        if subjID in seenIDs:
-            raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
-        else:
-            seenIDs.append(subjID)
-            outputfile = "sub-" + subjID.zfill(5) + "_task-dotprobe_run01_events.tsv"
 
-        thisData.write(join(snap3outdir, outputfile))
-    except:
-        raise Exception('Unable to process subject {}'.format(subjID))
\ No newline at end of file
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert DotProbe event files to BIDS tsv files.')
+    parser.add_argument('--basefolder', default=basefolder,
+                        help='folder holding the task data for each cohort and the Converted Files folder')
+    parser.add_argument('--error-file', default=errorFileName,
+                        help='word pair file for the optional extra error checking of SNAP 1 (e.g. ./dotprobe-wordpairs.csv)')
+    args = parser.parse_args(argv)
+
+    # read, clean, and write data
+    for job in listJobs(args.basefolder, args.error_file):
+        convert(*job)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,10 +5,16 @@
 # Note that several data items needed timing adjustments. This was required to correct for timing differences in the original code after porting to ePrime. A team of collaborators in Oregon made these decisions, however the exact justification for this was not recorded. This information was obtained from Dr. Eva Telzer during a meeting on Feb 16th, 2021. These items have comments designating them below.
 
 from os import listdir
-from os.path import isfile, join
+from os.path import basename, isfile, join
+import argparse
 import numpy as np
 import pandas
 
+from eprime_io import readColumns
+from frame_assembly import ColumnCollector
+from recode import recode
+from stage_timing import timed
+
 # turning off a warning that occurs with some chained commands.
 pandas.options.mode.chained_assignment = None
 
@@ -17,6 +23,7 @@ class Data:
     def __init__(self, dataFileName):
         self.contents = None
         self.dataFile = dataFileName
+        self.encoding = None
         self.stimuli = [Drive()]
         self.readFields = self.__declareReadFields()
         self.writeFields = self.__declareWriteFields()
@@ -33,33 +40,32 @@ class Data:
                        'trial']
         return writeFields
 
+    @timed
     def load(self):
-        # These try-except blocks have been tailored to the particular data files being parsed in order to accommodate
-        # the different encodings that were encountered
         try:
-            self.contents = pandas.read_csv(self.dataFile, usecols=self.readFields)
+            self.contents, self.encoding = readColumns(self.dataFile, self.readFields, sep=',')
         except:
             raise Exception('Unable to load {}'.format(self.dataFile))
 
+    @timed
     def clean(self):
-        cleanedData = pandas.DataFrame(columns=self.writeFields)
+        collector = ColumnCollector(self.writeFields)
 
         # go through each stimuli type and reorganize data belonging to this type
         for stimType in self.stimuli:
-            stimData = stimType.clean(self.contents, self.writeFields)
-            cleanedData = pandas.concat([cleanedData, stimData])
-
-        # replace all nan with 'NA'
-        cleanedData.replace(np.nan, 'NA', inplace=True)
+            collector.add(stimType.clean(self.contents, self.writeFields))
+        cleanedData = collector.assemble()
 
         # sort by onset time
         cleanedData.sort_values(by='onset', inplace=True)
 
         self.contents = cleanedData
 
+    @timed
     def write(self, outputfile):
         if self.contents is not None:
-            self.contents.to_csv(outputfile, sep='\t', index=False)
+            # missing values are written as 'NA', so the columns can keep their numeric types until here
+            self.contents.to_csv(outputfile, sep='\t', na_rep='NA', index=False)
 
 
 # specific types of stimuli in the task
@@ -97,14 +103,6 @@ class Drive:
                                     + self.trialField))
 
     def error_check(self, dataName, data, dataDict=None):
-        if dataName == 'decision_timing':
-            # Check if there exists other event names to recode since documentation was lacking on this aspect.
-            possibleVals = set(dataDict.values()) | {np.nan}
-            entriesNotConverted = set(data.iloc[:, 0]).difference(possibleVals)
-            if entriesNotConverted:
-                pass
-                #raise Exception('Entries not accounted for in recoding of decision_timing values')
-
         if dataName == 'crash_onset':
             # Check that there are always positive non-zero values of crash_onset when the decision_timing was labelled 'GoAfterRed' as this appears to not always be true.
             afterRedCrashOnsets = data.loc[data['decision_timing'] == "GoAfterRed", 'crash_onset']
@@ -114,6 +112,7 @@ class Drive:
                 pass
                 #raise Exception('No valid crash_onset found when decision_timing is \"GoAfterRed\"')
 
+    @timed
     def clean(self, rawData, outputFields):
         # sort raw data by onset - needed for some calculations
         rawData = rawData.sort_values(by=self.onsetField).reset_index(drop=True)
@@ -168,8 +167,8 @@ class Drive:
         decision_timing = rawData[self.decision_timingField]
         decision_timingRecodeVals = {"red": "DecisionBeforeRed", "cra": "GoAfterRed", "Bra": "Brake"}
         decision_timing = decision_timing.rename(columns={decision_timing.columns[0]: 'decision_timing'})
-        decision_timing = decision_timing.replace({"decision_timing": decision_timingRecodeVals})
-        self.error_check('decision_timing', decision_timing, decision_timingRecodeVals)
+        # other event names (documentation was lacking on this aspect) are reported by recode
+        decision_timing = recode(decision_timing, {'decision_timing': decision_timingRecodeVals})
 
         # fix crash onset timing for delayed decisions
         # note that collaborators in Oregon decided that the 300 value needed to be added to the crash_onsets (see note at top).
@@ -199,36 +198,67 @@ class Drive:
 
 
 # path to data
+# default location of the data, which can be changed with --basefolder.
+# all other folders are relative to this one.
 basefolder = "/mnt/magaj/SNAP/Data/Task Behavioral Data for BIDS/"
-snap1datadir = basefolder + "SNAP 1/Driving/Driving Scan CSV/"
-snap1practiceDatadir = basefolder + "SNAP 1/Driving/Driving Practice CSV/"
-
-# getting list of files
-snap1files = [f for f in listdir(snap1datadir) if isfile(join(snap1datadir, f))]
-snap1pacticeFiles = [f for f in listdir(snap1practiceDatadir) if isfile(join(snap1practiceDatadir, f))]
+snap1datadir = "SNAP 1/Driving/Driving Scan CSV/"
+snap1practiceDatadir = "SNAP 1/Driving/Driving Practice CSV/"
 
 # output folder
-snap1outdir = basefolder + "Converted Files/SNAP 1/Driving/"
-snap1practiceOutdir = basefolder + "Converted Files/SNAP 1/Driving/Driving Practice/"
+snap1outdir = "Converted Files/SNAP 1/Driving/"
+snap1practiceOutdir = "Converted Files/SNAP 1/Driving/Driving Practice/"
+
+
+def subjectID(datafile):
+    return str(''.join(filter(str.isdigit, datafile)))
+
+
+def listJobs(basefolder=basefolder):
+    # pair every data file with its output file across all cohorts
+    jobs = []
+    for datadir, outdir in [(snap1datadir, snap1outdir)]:
+        seenIDs = []
+        datadir = join(basefolder, datadir)
+        outdir = join(basefolder, outdir)
+        files = [f for f in listdir(datadir) if isfile(join(datadir, f))]
+        for datafile in files:
+            subjID = subjectID(datafile)
+
+            if subjID in seenIDs:
+                # making sure there is no duplicate file as this would silently overwrite output from the first file
+                raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
+            else:
+                seenIDs.append(subjID)
+                outputfile = "sub-" + subjID.zfill(5) + "_task-driving_run01_events.tsv"
 
-# read, clean, and write data
-seenIDs = []
-for datafile in snap1files:
-    thisData = Data(join(snap1datadir, datafile))
-    subjID = str(''.join(filter(str.isdigit, datafile)))
+            jobs.append((join(datadir, datafile), join(outdir, outputfile)))
+
+    return jobs
+
+
+def convert(datafile, outputfile):
+    # read, clean, and write data for a single subject
+    thisData = Data(datafile)
+    subjID = subjectID(basename(datafile))
 
     try:
         thisData.load()
         thisData.clean()
-
-        if subjID in seenIDs:
-            # making sure there is no duplicate file as this would silently overwrite output from the first file
-            raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
-        else:
-            seenIDs.append(subjID)
-            outputfile = "sub-" + subjID.zfill(5) + "_task-driving_run01_events.tsv"
-
-        thisData.write(join(snap1outdir, outputfile))
+        thisData.write(outputfile)
     except:
         raise Exception('Unable to process subject {}'.format(subjID))
 
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert Driving event files to BIDS tsv files.')
+    parser.add_argument('--basefolder', default=basefolder,
+                        help='folder holding the task data for each cohort and the Converted Files folder')
+    args = parser.parse_args(argv)
+
+    # read, clean, and write data
+    for job in listJobs(args.basefolder):
+        convert(*job)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,15 +3,22 @@
 # Only data deemed relevant for analysis have been retained, however this has been construed broadly.
 
 from os import listdir
-from os.path import isfile, join
+from os.path import basename, isfile, join
+import argparse
 import numpy as np
 import pandas
 
+from eprime_io import readColumns
+from frame_assembly import ColumnCollector
+from recode import recode
+from stage_timing import timed
+
 
 class Data:
     def __init__(self, dataFileName):
         self.contents = None
         self.dataFile = dataFileName
+        self.encoding = None
         self.stimuli = [Faces()]
         self.readFields = self.__declareReadFields()
         self.writeFields = self.__declareWriteFields()
@@ -29,26 +36,25 @@ class Data:
                        'set', 'trial', 'block']
         return writeFields
 
+    @timed
     def load(self):
         try:
-            self.contents = pandas.read_csv(self.dataFile, sep='\t', usecols=self.readFields)
+            self.contents, self.encoding = readColumns(self.dataFile, self.readFields)
         except:
             raise Exception('Unable to load {}'.format(self.dataFile))
 
+    @timed
     def clean(self):
-        cleanedData = pandas.DataFrame(columns=self.writeFields)
+        collector = ColumnCollector(self.writeFields)
 
         # go through each stimuli type and reorganize data belonging to this type
         for stimType in self.stimuli:
-            stimData = stimType.clean(self.contents, self.writeFields)
-            cleanedData = pandas.concat([cleanedData, stimData])
+            collector.add(stimType.clean(self.contents, self.writeFields))
+        cleanedData = collector.assemble()
 
         # shift all time stamps so the experiment starts at time 0
         #cleanedData = self.__shiftTime(cleanedData)
 
-        # replace all nan with 'NA'
-        cleanedData.replace(np.nan, 'NA', inplace=True)
-
         # sort by onset time
         cleanedData.sort_values(by='onset', inplace=True)
 
@@ -64,9 +70,11 @@ class Data:
 
         return data
 
+    @timed
     def write(self, outputfile):
         if self.contents is not None:
-            self.contents.to_csv(outputfile, sep='\t', index=False)
+            # missing values are written as 'NA', so the columns can keep their numeric types until here
+            self.contents.to_csv(outputfile, sep='\t', na_rep='NA', index=False)
 
 
 # specific types of stimuli in the task
@@ -130,6 +138,7 @@ class Faces:
             if not timeNAmatches.all() or not scanTimeNAmatches.all():
                 raise Exception('Mismatch in blank entries for response and response timings (RT and/or scan time).')
 
+    @timed
     def clean(self, rawData, outputFields):
         # calculate onset time
         onset = rawData['Stim.OnsetTime'] - rawData['FixationInput.OffsetTime'] + 1
@@ -172,7 +181,7 @@ class Faces:
         response = response.squeeze().astype('str').str.strip()
         response = response.to_frame('response').replace('', np.nan).astype('float').astype('Int64')
         responseRecodeVals = {2: "right", 7: "left"}
-        response = response.replace({'response': responseRecodeVals})
+        response = recode(response, {'response': responseRecodeVals})
 
         self.error_check('response', pandas.concat([response, reaction_time, reaction_scantime], axis=1))
 
@@ -181,7 +190,7 @@ class Faces:
         correct_response = correct_response.squeeze().astype('str').str.strip()
         correct_response = correct_response.to_frame('correct_response').replace('', np.nan).astype('float').astype('Int64') # cast to int for recoding
         correct_responseRecodeVals = {2: "right", 7: "left"}
-        correct_response = correct_response.replace({'correct_response': correct_responseRecodeVals})
+        correct_response = recode(correct_response, {'correct_response': correct_responseRecodeVals})
 
         # recode accuracy
         # if the correct response was NaN, also make NaN.
@@ -189,12 +198,13 @@ class Faces:
         m = pandas.isna(correct_response).squeeze()
         accuracy = accuracy.to_frame('accuracy').mask(m, np.nan)
         accuracyRecodeVals = {1: "correct", 0: "incorrect"}
-        accuracy = accuracy.replace({'accuracy': accuracyRecodeVals})
+        accuracy = recode(accuracy, {'accuracy': accuracyRecodeVals})
 
         # recode trial type
         trial_type = rawData[self.trial_typeField]
         trial_typeRecodeVals = {1: "ShapesMatch", 2: "NegObserve", 3: "NegMatch", 4: "ShapesMatch", 5: "NegObserve", 6: "NegMatch", 7: "PosObserve", 8: "PosObserve", 9: "PosMatch", 10: "PosMatch"}
-        trial_type = trial_type.rename(columns={trial_type.columns[0]: 'trial_type'}).replace({'trial_type': trial_typeRecodeVals})
+        trial_type = trial_type.rename(columns={trial_type.columns[0]: 'trial_type'})
+        trial_type = recode(trial_type, {'trial_type': trial_typeRecodeVals})
 
         # extract target label
         target_label = rawData[self.target_labelField]
@@ -204,12 +214,14 @@ class Faces:
         # extract distractor label
         distractor_label = rawData[self.distractor_labelField]
         distractor_labelRecodeVals = {' ': np.nan}
-        distractor_label = distractor_label.rename(columns={distractor_label.columns[0]: 'distractor_label'}).replace({'distractor_label': distractor_labelRecodeVals})
+        distractor_label = distractor_label.rename(columns={distractor_label.columns[0]: 'distractor_label'})
+        distractor_label = recode(distractor_label, {'distractor_label': distractor_labelRecodeVals}, onUnmapped='keep')
 
         # extract ethnicity/race and strip all white space
         race = rawData[self.raceField]
         raceRecodeVals = {' ': np.nan}
-        race = race.rename(columns={race.columns[0]: 'race'}).replace({'race': raceRecodeVals})
+        race = race.rename(columns={race.columns[0]: 'race'})
+        race = recode(race, {'race': raceRecodeVals}, onUnmapped='keep')
         race['race'] = race['race'].str.replace(" ", "")
 
         # extract image file name
@@ -243,34 +255,65 @@ class Faces:
 
 
 # path to data
+# default location of the data, which can be changed with --basefolder.
+# all other folders are relative to this one.
 basefolder = "/mnt/magaj/SNAP/Data/Task Behavioral Data for BIDS/"
-snap1datadir = basefolder + "SNAP 1/Matching/"
+snap1datadir = "SNAP 1/Matching/"
 
+# output folder
+snap1outdir = "Converted Files/SNAP 1/Emotion/"
 
-# getting list of files
-snap1files = [f for f in listdir(snap1datadir) if isfile(join(snap1datadir, f))]
 
-# output folder
-snap1outdir = basefolder + "Converted Files/SNAP 1/Emotion/"
+def subjectID(datafile):
+    return str(''.join(filter(str.isdigit, datafile)))
+
+
+def listJobs(basefolder=basefolder):
+    # pair every data file with its output file across all cohorts
+    jobs = []
+    for datadir, outdir in [(snap1datadir, snap1outdir)]:
+        seenIDs = []
+        datadir = join(basefolder, datadir)
+        outdir = join(basefolder, outdir)
+        files = [f for f in listdir(datadir) if isfile(join(datadir, f))]
+        for datafile in files:
+            subjID = subjectID(datafile)
+
+            if subjID in seenIDs:
+                # making sure there is no duplicate file as this would silently overwrite output from the first file
+                raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
+            else:
+                seenIDs.append(subjID)
+                outputfile = "sub-" + subjID.zfill(5) + "_task-emotion_run01_events.tsv"
+
+            jobs.append((join(datadir, datafile), join(outdir, outputfile)))
 
-# read, clean, and write data
-seenIDs = []
-for datafile in snap1files:
-    thisData = Data(join(snap1datadir, datafile))
-    subjID = str(''.join(filter(str.isdigit, datafile)))
+    return jobs
+
+
+def convert(datafile, outputfile):
+    # read, clean, and write data for a single subject
+    thisData = Data(datafile)
+    subjID = subjectID(basename(datafile))
 
     try:
         thisData.load()
         thisData.clean()
-
-        if subjID in seenIDs:
-            # making sure there is no duplicate file as this would silently overwrite output from the first file
-            raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
-        else:
-            seenIDs.append(subjID)
-            outputfile = "sub-" + subjID.zfill(5) + "_task-emotion_run01_events.tsv"
-
-        thisData.write(join(snap1outdir, outputfile))
+        thisData.write(outputfile)
     except:
         raise Exception('Unable to process subject {}'.format(subjID))
 
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert Emotion event files to BIDS tsv files.')
+    parser.add_argument('--basefolder', default=basefolder,
+                        help='folder holding the task data for each cohort and the Converted Files folder')
+    args = parser.parse_args(argv)
+
+    # read, clean, and write data
+    for job in listJobs(args.basefolder):
+        convert(*job)
+
+
+if __name__ == '__main__':
+    main()
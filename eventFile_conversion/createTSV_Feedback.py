@@ -3,15 +3,22 @@
 # Only data deemed relevant for analysis have been retained, however this has been construed broadly.
 
 from os import listdir
-from os.path import isfile, join
+from os.path import basename, isfile, join
+import argparse
 import numpy as np
 import pandas
 
+from eprime_io import readColumns
+from frame_assembly import ColumnCollector
+from recode import recode
+from stage_timing import timed
+
 
 class Data:
     def __init__(self, dataFileName):
         self.contents = None
         self.dataFile = dataFileName
+        self.encoding = None
         self.stimuli = [Choice()]
         self.readFields = self.__declareReadFields()
         self.writeFields = self.__declareWriteFields()
@@ -29,29 +36,28 @@ class Data:
                        'response', 'trial', 'block']
         return writeFields
 
+    @timed
     def load(self):
         try:
-            self.contents = pandas.read_csv(self.dataFile, sep='\t', usecols=self.readFields, encoding='utf_16_le')
+            self.contents, self.encoding = readColumns(self.dataFile, self.readFields)
         except:
             raise Exception('Unable to load {}'.format(self.dataFile))
 
+    @timed
     def clean(self):
-        cleanedData = pandas.DataFrame(columns=self.writeFields)
+        collector = ColumnCollector(self.writeFields)
 
         # go through each stimuli type and reorganize data belonging to this type
         for stimType in self.stimuli:
-            stimData = stimType.clean(self.contents, self.writeFields)
-            cleanedData = pandas.concat([cleanedData, stimData])
+            collector.add(stimType.clean(self.contents, self.writeFields))
+        cleanedData = collector.assemble()
 
         # shift all time stamps so the experiment starts at time 0
         #cleanedData = self.__shiftTime(cleanedData)
 
-        # sort by onset time -- some of the onset data is incomplete so sorting before replacing NaNs.
+        # sort by onset time -- some of the onset data is incomplete, so missing onsets are sorted last.
         cleanedData.sort_values(by='onset', inplace=True, na_position='last')
 
-        # replace all nan with 'NA'
-        cleanedData.replace(np.nan, 'NA', inplace=True)
-
         self.contents = cleanedData
 
     def __shiftTime(self, data):
@@ -65,9 +71,11 @@ class Data:
 
         return data
 
+    @timed
     def write(self, outputfile):
         if self.contents is not None:
-            self.contents.to_csv(outputfile, sep='\t', index=False)
+            # missing values are written as 'NA', so the columns can keep their numeric types until here
+            self.contents.to_csv(outputfile, sep='\t', na_rep='NA', index=False)
 
 
 # specific types of stimuli in the task
@@ -117,6 +125,7 @@ class Choice:
                                     + self.right_wordField + self.responseField + self.trialField \
                                     + self.blockField ))
 
+    @timed
     def clean(self, rawData, outputFields):
         # calculate onset time
         onset = rawData['Stim.OnsetTime'] - rawData['fix.OnsetTime']
@@ -168,7 +177,7 @@ class Choice:
         feedback_type = rawData[self.feedback_typeField]
         feedback_typeRecodeVals = {"Pos": "pos", "Neg": "neg", "Neut": "neu"}
         feedback_type = feedback_type.rename(columns={feedback_type.columns[0]: 'feedback_type'})
-        feedback_type = feedback_type.replace({"feedback_type": feedback_typeRecodeVals})
+        feedback_type = recode(feedback_type, {'feedback_type': feedback_typeRecodeVals})
 
         # extract stimulus category
         stim_category = rawData[self.stim_categoryField]
@@ -185,7 +194,8 @@ class Choice:
         # recode values for response
         response = rawData[self.responseField]
         responseRecodeVals = {2: "right", 7: "left"}
-        response = response.rename(columns={response.columns[0]: 'response'}).replace({'response': responseRecodeVals})
+        response = response.rename(columns={response.columns[0]: 'response'})
+        response = recode(response, {'response': responseRecodeVals})
 
         # extract trial number
         trial = rawData[self.trialField]
@@ -210,55 +220,67 @@ class Choice:
 
 
 # path to data
+# default location of the data, which can be changed with --basefolder.
+# all other folders are relative to this one.
 basefolder = "/mnt/magaj/SNAP/Data/Task Behavioral Data for BIDS/"
-snap2datadir = basefolder + "SNAP 2/Social Feedback Task (Opinion)/"
-snap3datadir = basefolder + "SNAP 3/Social Feedback Task (Opinion)/"
-
-# getting list of files
-snap2files = [f for f in listdir(snap2datadir) if isfile(join(snap2datadir, f))]
-snap3files = [f for f in listdir(snap3datadir) if isfile(join(snap3datadir, f))]
+snap2datadir = "SNAP 2/Social Feedback Task (Opinion)/"
+snap3datadir = "SNAP 3/Social Feedback Task (Opinion)/"
 
 # output folder
-snap2outdir = basefolder + "Converted Files/SNAP 2/Feedback/"
-snap3outdir = basefolder + "Converted Files/SNAP 3/Feedback/"
+snap2outdir = "Converted Files/SNAP 2/Feedback/"
+snap3outdir = "Converted Files/SNAP 3/Feedback/"
 
-# read, clean, and write data
-seenIDs = []
-for datafile in snap2files:
-    thisData = Data(join(snap2datadir, datafile))
-    subjID = str(''.join(filter(str.isdigit, datafile)))
 
-    try:
-        thisData.load()
-        thisData.clean()
+def subjectID(datafile):
+    return str(''.join(filter(str.isdigit, datafile)))
 
-        if subjID in seenIDs:
-            # making sure there is no duplicate file as this would silently overwrite output from the first file
-            raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
-        else:
-            seenIDs.append(subjID)
-            outputfile = "sub-" + subjID.zfill(5) + "_task-feedback_run01_events.tsv"
 
-        thisData.write(join(snap2outdir, outputfile))
-    except:
-        raise Exception('Unable to process subject {}'.format(subjID))
+def listJobs(basefolder=basefolder):
+    # pair every data file with its output file across all cohorts
+    jobs = []
+    seenIDs = []
+    for datadir, outdir in [(snap2datadir, snap2outdir), (snap3datadir, snap3outdir)]:
+        datadir = join(basefolder, datadir)
+        outdir = join(basefolder, outdir)
+        files = [f for f in listdir(datadir) if isfile(join(datadir, f))]
+        for datafile in files:
+            subjID = subjectID(datafile)
+
+            if subjID in seenIDs:
+                # making sure there is no duplicate file as this would silently overwrite output from the first file
+                raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
+            else:
+                seenIDs.append(subjID)
+                outputfile = "sub-" + subjID.zfill(5) + "_task-feedback_run01_events.tsv"
 
+            jobs.append((join(datadir, datafile), join(outdir, outputfile)))
 
-for datafile in snap3files:
-    thisData = Data(join(snap3datadir, datafile))
-    subjID = str(''.join(filter(str.isdigit, datafile)))
+    return jobs
+
+
+def convert(datafile, outputfile):
+    # read, clean, and write data for a single subject
+    thisData = Data(datafile)
+    subjID = subjectID(basename(datafile))
 
     try:
         thisData.load()
         thisData.clean()
+        thisData.write(outputfile)
+    except:
+        raise Exception('Unable to process subject {}'.format(subjID))
 
-        if subjID in seenIDs:
-            # making sure there is no duplicate file as this would silently overwrite output from the first file
-            raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
-        else:
-            seenIDs.append(subjID)
-            outputfile = "sub-" + subjID.zfill(5) + "_task-feedback_run01_events.tsv"
 
-        thisData.write(join(snap3outdir, outputfile))
-    except:
-        raise Exception('Unable to process subject {}'.format(subjID))
\ No newline at end of file
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert Feedback event files to BIDS tsv files.')
+    parser.add_argument('--basefolder', default=basefolder,
+                        help='folder holding the task data for each cohort and the Converted Files folder')
+    args = parser.parse_args(argv)
+
+    # read, clean, and write data
+    for job in listJobs(args.basefolder):
+        convert(*job)
+
+
+if __name__ == '__main__':
+    main()
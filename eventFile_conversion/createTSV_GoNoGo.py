@@ -3,15 +3,23 @@
 # Only data deemed relevant for analysis have been retained, however this has been construed broadly.
 
 from os import listdir
-from os.path import isfile, join
+from os.path import basename, isfile, join
+import argparse
 import numpy as np
 import pandas
 
+from coalesce import coalesce
+from eprime_io import readColumns
+from frame_assembly import ColumnCollector
+from recode import recode
+from stage_timing import timed
+
 
 class Data:
     def __init__(self, dataFileName):
         self.contents = None
         self.dataFile = dataFileName
+        self.encoding = None
         self.stimuli = [HereWeGo(), Interblock(), Image()]
         self.readFields = self.__declareReadFields()
         self.writeFields = self.__declareWriteFields()
@@ -28,26 +36,25 @@ class Data:
                        'image_file', 'letter', 'set', 'trial', 'block']
         return writeFields
 
+    @timed
     def load(self):
         try:
-            self.contents = pandas.read_csv(self.dataFile, sep='\t', usecols=self.readFields, encoding='utf_16_le')
+            self.contents, self.encoding = readColumns(self.dataFile, self.readFields)
         except:
             raise Exception('Unable to load {}'.format(self.dataFile))
 
+    @timed
     def clean(self):
-        cleanedData = pandas.DataFrame(columns=self.writeFields)
+        collector = ColumnCollector(self.writeFields)
 
         # go through each stimuli type and reorganize data belonging to this type
         for stimType in self.stimuli:
-            stimData = stimType.clean(self.contents, self.writeFields)
-            cleanedData = pandas.concat([cleanedData, stimData])
+            collector.add(stimType.clean(self.contents, self.writeFields))
+        cleanedData = collector.assemble()
 
         # shift all time stamps so the experiment starts at time 0
         cleanedData = self.__shiftTime(cleanedData)
 
-        # replace all nan with 'NA'
-        cleanedData.replace(np.nan, 'NA', inplace=True)
-
         # sort by onset time
         cleanedData.sort_values(by='onset', inplace=True)
 
@@ -63,9 +70,11 @@ class Data:
 
         return data
 
+    @timed
     def write(self, outputfile):
         if self.contents is not None:
-            self.contents.to_csv(outputfile, sep='\t', index=False)
+            # missing values are written as 'NA', so the columns can keep their numeric types until here
+            self.contents.to_csv(outputfile, sep='\t', na_rep='NA', index=False)
 
 
 # specific types of stimuli in the task
@@ -97,18 +106,19 @@ class HereWeGo:
 
     def error_check(self, dataName, data):
         if dataName == 'onset':
-            # Check that there is only one entry per row
-            numEntries = data.count(axis=1)
-            if (numEntries > 1).any():
+            # Check that there is only one entry per row (data marks the rows with several)
+            if data.any():
                 raise Exception('Multiple line entries found for HereWeGo onsets')
 
+    @timed
     def clean(self, rawData, outputFields):
         # combine onset data into one column
         onset = rawData[self.onsetField]
         onset = onset.drop_duplicates()
-        self.error_check('onset', onset)
+        onset, multiple = coalesce(onset)
+        self.error_check('onset', multiple)
 
-        data = onset.sum(axis=1, min_count=1).to_frame('onset').astype(int)
+        data = onset.to_frame('onset').astype(int)
 
         # create columns for each field with the static values set at initialization
         # this crucially depends on a few assumptions:
@@ -150,18 +160,19 @@ class Interblock:
 
     def error_check(self, dataName, data):
         if dataName == 'onset':
-            # Check that there is only one entry per row
-            numEntries = data.count(axis=1)
-            if (numEntries > 1).any():
+            # Check that there is only one entry per row (data marks the rows with several)
+            if data.any():
                 raise Exception('Multiple line entries found for Interblock onsets')
 
+    @timed
     def clean(self, rawData, outputFields):
         # combine onset data into one column
         onset = rawData[self.onsetField]
         onset = onset.drop_duplicates()
-        self.error_check('onset', onset)
+        onset, multiple = coalesce(onset)
+        self.error_check('onset', multiple)
 
-        data = onset.sum(axis=1, min_count=1).to_frame('onset').astype(int)
+        data = onset.to_frame('onset').astype(int)
 
         # create columns for each field with the values set at initialization
         for attrName in outputFields:
@@ -215,58 +226,57 @@ class Image:
                                     + self.trialField + self.blockField))
 
     def error_check(self, dataName, data):
-        if dataName == 'onset' or 'response' or 'reaction_time' or 'reaction_scantime' or 'image_onset' \
-                or 'letter_onset':
-            # Check that there is only one entry per row
-            numEntries = data.count(axis=1)
-            if (numEntries > 1).any():
+        if dataName in ['onset', 'response', 'reaction_time', 'reaction_scantime', 'image_onset', 'letter_onset']:
+            # Check that there is only one entry per row (data marks the rows with several)
+            if data.any():
                 raise Exception('Multiple line entries found for Image {}'.format(dataName))
 
+    @timed
     def clean(self, rawData, outputFields):
         # combine onset data into one column
-        onset = rawData[self.onsetField]
-        self.error_check('onset', onset)
-        onset = onset.sum(axis=1, min_count=1).to_frame('onset').astype(int)
+        onset, multiple = coalesce(rawData[self.onsetField])
+        self.error_check('onset', multiple)
+        onset = onset.to_frame('onset').astype(int)
 
         # recode values for valence
         valence = rawData[self.valenceField]
         valenceRecodeVals = {"NS": "NegScrambled", "PS": "PosScrambled",
                              "P": "Positive", "N": "Negative"}
         valence = valence.rename(columns={valence.columns[0]: 'valence'})
-        valence = valence.replace({"valence": valenceRecodeVals})
+        valence = recode(valence, {'valence': valenceRecodeVals})
 
         # recode values for gonogo
         gonogo = rawData[self.gonogoField]
         gonogoRecodeVals = {0: "NoGo", 1: "Go"}
         gonogo = gonogo.rename(columns={gonogo.columns[0]: 'gonogo'})
-        gonogo = gonogo.replace({"gonogo": gonogoRecodeVals})
+        gonogo = recode(gonogo, {'gonogo': gonogoRecodeVals})
 
         # combine response data into one column and recode
-        response = rawData[self.responseField]
-        self.error_check('response', response)
-        response = response.sum(axis=1, min_count=1).to_frame('response').astype('Int64')
+        response, multiple = coalesce(rawData[self.responseField])
+        self.error_check('response', multiple)
+        response = response.to_frame('response').astype('Int64')
         responseRecodeVals = {2: "press"}
-        response = response.replace({"response": responseRecodeVals})
+        response = recode(response, {'response': responseRecodeVals})
 
         # combine reaction time
-        reaction_time = rawData[self.reaction_timeField].replace(0, np.nan)
-        self.error_check('reaction_time', reaction_time)
-        reaction_time = reaction_time.sum(axis=1, min_count=1).to_frame('reaction_time').astype('Int64')
+        reaction_time, multiple = coalesce(rawData[self.reaction_timeField].replace(0, np.nan))
+        self.error_check('reaction_time', multiple)
+        reaction_time = reaction_time.to_frame('reaction_time').astype('Int64')
 
         # combine reaction scan time
-        reaction_scantime = rawData[self.reaction_scantimeField].replace(0, np.nan)
-        self.error_check('reaction_scantime', reaction_scantime)
-        reaction_scantime = reaction_scantime.sum(axis=1, min_count=1).to_frame('reaction_scantime').astype('Int64')
+        reaction_scantime, multiple = coalesce(rawData[self.reaction_scantimeField].replace(0, np.nan))
+        self.error_check('reaction_scantime', multiple)
+        reaction_scantime = reaction_scantime.to_frame('reaction_scantime').astype('Int64')
 
         # combine image onset
-        image_onset = rawData[self.image_onsetField]
-        self.error_check('image_onset', image_onset)
-        image_onset = image_onset.sum(axis=1, min_count=1).to_frame('image_onset').astype(int)
+        image_onset, multiple = coalesce(rawData[self.image_onsetField])
+        self.error_check('image_onset', multiple)
+        image_onset = image_onset.to_frame('image_onset').astype(int)
 
         # combine letter onset
-        letter_onset = rawData[self.letter_onsetField]
-        self.error_check('letter_onset', letter_onset)
-        letter_onset = letter_onset.sum(axis=1, min_count=1).to_frame('letter_onset').astype(int)
+        letter_onset, multiple = coalesce(rawData[self.letter_onsetField])
+        self.error_check('letter_onset', multiple)
+        letter_onset = letter_onset.to_frame('letter_onset').astype(int)
 
         image_file = rawData[self.image_fileField]
         image_file = image_file.apply(lambda s: s.str.replace('\\', '/')) # replacing escaped backslash in file names
@@ -284,7 +294,7 @@ class Image:
                          "Pos1": "PositiveSet1", "Pos2": "PositiveSet2",
                          "Pos3": "PositiveSet3", "Pos4": "PositiveSet4"}
         set = set.rename(columns={set.columns[0]: 'set'})
-        set = set.replace({"set": setRecodeVals})
+        set = recode(set, {'set': setRecodeVals})
 
         trial = rawData[self.trialField]
         trial = trial.rename(columns={trial.columns[0]: 'trial'})
@@ -306,54 +316,67 @@ class Image:
 
 
 # path to data
+# default location of the data, which can be changed with --basefolder.
+# all other folders are relative to this one.
 basefolder = "/mnt/magaj/SNAP/Data/Task Behavioral Data for BIDS/"
-snap2datadir = basefolder + "SNAP 2/Emotional Go_No-go (Reaction)/"
-snap3datadir = basefolder + "SNAP 3/Emotional Go_No-go (Reaction)/"
-
-# getting list of files
-snap2files = [f for f in listdir(snap2datadir) if isfile(join(snap2datadir, f))]
-snap3files = [f for f in listdir(snap3datadir) if isfile(join(snap3datadir, f))]
+snap2datadir = "SNAP 2/Emotional Go_No-go (Reaction)/"
+snap3datadir = "SNAP 3/Emotional Go_No-go (Reaction)/"
 
 # output folder
-snap2outdir = basefolder + "Converted Files/SNAP 2/GoNoGo/"
-snap3outdir = basefolder + "Converted Files/SNAP 3/GoNoGo/"
+snap2outdir = "Converted Files/SNAP 2/GoNoGo/"
+snap3outdir = "Converted Files/SNAP 3/GoNoGo/"
 
-# read, clean, and write data
-seenIDs = []
-for datafile in snap2files:
-    thisData = Data(join(snap2datadir, datafile))
-    subjID = str(''.join(filter(str.isdigit, datafile)))
 
-    try:
-        thisData.load()
-        thisData.clean()
+def subjectID(datafile):
+    return str(''.join(filter(str.isdigit, datafile)))
 
-        if subjID in seenIDs:
-            # making sure there is no duplicate file as this would silently overwrite output from the first file
-            raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
-        else:
-            seenIDs.append(subjID)
-            outputfile = "sub-" + subjID.zfill(5) + "_task-gonogo_run-01_events.tsv"
 
-        thisData.write(join(snap2outdir, outputfile))
-    except:
-        raise Exception('Unable to process subject {}'.format(subjID))
+def listJobs(basefolder=basefolder):
+    # pair every data file with its output file across all cohorts
+    jobs = []
+    for datadir, outdir in [(snap2datadir, snap2outdir), (snap3datadir, snap3outdir)]:
+        seenIDs = []
+        datadir = join(basefolder, datadir)
+        outdir = join(basefolder, outdir)
+        files = [f for f in listdir(datadir) if isfile(join(datadir, f))]
+        for datafile in files:
+            subjID = subjectID(datafile)
+
+            if subjID in seenIDs:
+                # making sure there is no duplicate file as this would silently overwrite output from the first file
+                raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
+            else:
+                seenIDs.append(subjID)
+                outputfile = "sub-" + subjID.zfill(5) + "_task-gonogo_run-01_events.tsv"
 
-seenIDs = []
-for datafile in snap3files:
-    thisData = Data(join(snap3datadir, datafile))
-    subjID = str(''.join(filter(str.isdigit, datafile)))
+            jobs.append((join(datadir, datafile), join(outdir, outputfile)))
+
+    return jobs
+
+
+def convert(datafile, outputfile):
+    # read, clean, and write data for a single subject
+    thisData = Data(datafile)
+    subjID = subjectID(basename(datafile))
 
     try:
         thisData.load()
         thisData.clean()
-
-        if subjID in seenIDs:
-            raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
-        else:
-            seenIDs.append(subjID)
-            outputfile = "sub-" + subjID.zfill(5) + "_task-gonogo_run-01_events.tsv"
-
-        thisData.write(join(snap3outdir, outputfile))
+        thisData.write(outputfile)
     except:
         raise Exception('Unable to process subject {}'.format(subjID))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert GoNoGo event files to BIDS tsv files.')
+    parser.add_argument('--basefolder', default=basefolder,
+                        help='folder holding the task data for each cohort and the Converted Files folder')
+    args = parser.parse_args(argv)
+
+    # read, clean, and write data
+    for job in listJobs(args.basefolder):
+        convert(*job)
+
+
+if __name__ == '__main__':
+    main()
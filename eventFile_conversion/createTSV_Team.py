@@ -3,10 +3,17 @@
 # Only data deemed relevant for analysis have been retained, however this has been construed broadly.
 
 from os import listdir
-from os.path import isfile, join
+from os.path import basename, isfile, join
+import argparse
 import numpy as np
 import pandas
 
+from coalesce import coalesce
+from eprime_io import readColumns
+from frame_assembly import ColumnCollector
+from recode import recode
+from stage_timing import timed
+
 # turning off a warning that occurs with some chained commands.
 pandas.options.mode.chained_assignment = None
 
@@ -14,6 +21,7 @@ class Data:
     def __init__(self, dataFileName):
         self.contents = None
         self.dataFile = dataFileName
+        self.encoding = None
         self.stimuli = [HereWeGo(), Team()]
         self.readFields = self.__declareReadFields()
         self.writeFields = self.__declareWriteFields()
@@ -30,31 +38,32 @@ class Data:
                        'team', 'gender', 'race', 'filename', 'trial', 'block']
         return writeFields
 
+    @timed
     def load(self):
         try:
-            self.contents = pandas.read_csv(self.dataFile, sep='\t', usecols=self.readFields)
+            self.contents, self.encoding = readColumns(self.dataFile, self.readFields)
         except:
             raise Exception('Unable to load {}'.format(self.dataFile))
 
+    @timed
     def clean(self):
-        cleanedData = pandas.DataFrame(columns=self.writeFields)
+        collector = ColumnCollector(self.writeFields)
 
         # go through each stimuli type and reorganize data belonging to this type
         for stimType in self.stimuli:
-            stimData = stimType.clean(self.contents, self.writeFields)
-            cleanedData = pandas.concat([cleanedData, stimData])
-
-        # replace all nan with 'NA'
-        cleanedData.replace(np.nan, 'NA', inplace=True)
+            collector.add(stimType.clean(self.contents, self.writeFields))
+        cleanedData = collector.assemble()
 
         # sort by onset time
         cleanedData.sort_values(by='onset', inplace=True)
 
         self.contents = cleanedData
 
+    @timed
     def write(self, outputfile):
         if self.contents is not None:
-            self.contents.to_csv(outputfile, sep='\t', index=False)
+            # missing values are written as 'NA', so the columns can keep their numeric types until here
+            self.contents.to_csv(outputfile, sep='\t', na_rep='NA', index=False)
 
 # specific types of stimuli in the task
 class HereWeGo:
@@ -81,6 +90,7 @@ class HereWeGo:
         self.durationField = ['HereWeGo.Duration']
         self.inputFields = self.durationField
 
+    @timed
     def clean(self, rawData, outputFields):
         # combine duration data into one column
         duration = rawData[self.durationField]
@@ -139,10 +149,8 @@ class Team:
     def error_check(self, dataName, data):
         if dataName == 'single_response':
             # Verify that there is at most one response recorded across both the stimuli and jitter period.
-            no_response = pandas.isna(data['Stim.RESP']) & pandas.isna(data['Jitter.RESP'])
-            exactly1_response = pandas.isna(data['Stim.RESP']) ^ pandas.isna(data['Jitter.RESP'])
-            atmost1_response = no_response | exactly1_response
-            if not atmost1_response.all():
+            # (data marks the trials with a response in both)
+            if data.any():
                 raise Exception('Response recorded during both stimuli and jitter. Expecting at most one recorded response.')
         if dataName == 'no_response':
             # Verify that no response also has no reaction time and no reaction scan time recorded
@@ -151,6 +159,7 @@ class Team:
             if not timeNAmatches.all() or not scanTimeNAmatches.all():
                 raise Exception('Mismatch in blank entries for response and response timings (RT and/or scan time).')
 
+    @timed
     def clean(self, rawData, outputFields):
         # calculate onset time
         onset = rawData['Stim.OnsetTime'] - rawData['HereWeGo.OnsetTime'].iloc[0]
@@ -170,7 +179,7 @@ class Team:
         # replace missing values in the probe reaction time with any responses made during the jitter
         reaction_time = rawData[self.reaction_timeField]
         reaction_time[['Stim.RTTime', 'Jitter.RTTime']] = reaction_time[['Stim.RTTime', 'Jitter.RTTime']].replace(0, np.NaN)  # no response made during probe or jitter
-        reaction_time['Stim.RTTime'] = reaction_time['Stim.RTTime'].fillna(reaction_time['Jitter.RTTime'])  # replace missing stim time with jitter
+        reaction_time['Stim.RTTime'], _ = coalesce(reaction_time[['Stim.RTTime', 'Jitter.RTTime']])  # replace missing stim time with jitter
         reaction_time = reaction_time['Stim.RTTime'] - reaction_time['Stim.OnsetTime']
         reaction_time = reaction_time.to_frame('reaction_time').astype('Int64')
 
@@ -179,18 +188,18 @@ class Team:
         reaction_scantime = reaction_scantime.replace(0, np.NaN).to_frame('reaction_scantime').astype('Int64')
 
         # recode values for response
-        response = rawData[self.responseField]
-        #self.error_check('single_response', response) # disabling so will take first response if two
-        response = response['Stim.RESP'].mask(pandas.isna(response['Stim.RESP']), other=response['Jitter.RESP'])
+        response, multiple = coalesce(rawData[['Stim.RESP', 'Jitter.RESP']])
+        #self.error_check('single_response', multiple) # disabling so will take first response if two
         responseRecodeVals = {1: "Dislike a lot", 2: "Dislike a little", 3: "Like a little", 4: "Like a lot", 5: "CHANGETHIS!!"}
-        response = response.to_frame('response').replace({'response': responseRecodeVals})
+        response = recode(response.to_frame('response'), {'response': responseRecodeVals})
 
         self.error_check('no_response', pandas.concat([response, reaction_time, reaction_scantime], axis=1))
 
         # recode values for group affiliation
         group_affiliation = rawData[self.group_affiliationField]
         group_affiliationRecodeVals = {1: "ingroup", 2: "outgroup", 3: "unaffiliated"}
-        group_affiliation = group_affiliation.rename(columns={group_affiliation.columns[0]: 'group_affiliation'}).replace({'group_affiliation': group_affiliationRecodeVals})
+        group_affiliation = group_affiliation.rename(columns={group_affiliation.columns[0]: 'group_affiliation'})
+        group_affiliation = recode(group_affiliation, {'group_affiliation': group_affiliationRecodeVals})
 
         # extract team membership
         team = rawData[self.teamField]
@@ -229,39 +238,67 @@ class Team:
 
 
 # path to data
+# default location of the data, which can be changed with --basefolder.
+# all other folders are relative to this one.
 # note that this task has data split across several folders
 basefolder = "/mnt/magaj/SNAP/Data/Task Behavioral Data for BIDS/"
-snap1datadir1 = basefolder + "SNAP 1/Team Game/Scan Task/Edat/"
-snap1datadir2 = basefolder + "SNAP 1/Team Game/Scan Task/New Edat/"
+snap1datadir1 = "SNAP 1/Team Game/Scan Task/Edat/"
+snap1datadir2 = "SNAP 1/Team Game/Scan Task/New Edat/"
 
 # output folder
-snap1outdir = basefolder + "Converted Files/SNAP 1/Team/Scan Task/"
-
-# getting list of files and their paths
-snap1files1 = [f for f in listdir(snap1datadir1) if isfile(join(snap1datadir1, f))]
-snap1files1path = [snap1datadir1 for d in snap1files1]
-snap1files2 = [f for f in listdir(snap1datadir2) if isfile(join(snap1datadir2, f))]
-snap1files2path = [snap1datadir2 for d in snap1files2]
-snap1files = snap1files1 + snap1files2
-snap1datadir = snap1files1path + snap1files2path
-
-# read, clean, and write data
-seenIDs = []
-for i, datafile in enumerate(snap1files):
-    thisData = Data(join(snap1datadir[i], datafile))
-    subjID = str(''.join(filter(str.isdigit, datafile)))
+snap1outdir = "Converted Files/SNAP 1/Team/Scan Task/"
+
+
+def subjectID(datafile):
+    return str(''.join(filter(str.isdigit, datafile)))
+
+
+def listJobs(basefolder=basefolder):
+    # pair every data file with its output file across all cohorts
+    jobs = []
+    seenIDs = []
+    for datadir, outdir in [(snap1datadir1, snap1outdir), (snap1datadir2, snap1outdir)]:
+        datadir = join(basefolder, datadir)
+        outdir = join(basefolder, outdir)
+        files = [f for f in listdir(datadir) if isfile(join(datadir, f))]
+        for datafile in files:
+            subjID = subjectID(datafile)
+
+            if subjID in seenIDs:
+                # making sure there is no duplicate file as this would silently overwrite output from the first file
+                raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
+            else:
+                seenIDs.append(subjID)
+                outputfile = "sub-" + subjID.zfill(5) + "_task-team_run01_events.tsv"
+
+            jobs.append((join(datadir, datafile), join(outdir, outputfile)))
+
+    return jobs
+
+
+def convert(datafile, outputfile):
+    # read, clean, and write data for a single subject
+    thisData = Data(datafile)
+    subjID = subjectID(basename(datafile))
 
     try:
         thisData.load()
         thisData.clean()
-
-        if subjID in seenIDs:
-            # making sure there is no duplicate file as this would silently overwrite output from the first file
-            raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
-        else:
-            seenIDs.append(subjID)
-            outputfile = "sub-" + subjID.zfill(5) + "_task-team_run01_events.tsv"
-
-        thisData.write(join(snap1outdir, outputfile))
+        thisData.write(outputfile)
     except:
         raise Exception('Unable to process subject {}'.format(subjID))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert Team event files to BIDS tsv files.')
+    parser.add_argument('--basefolder', default=basefolder,
+                        help='folder holding the task data for each cohort and the Converted Files folder')
+    args = parser.parse_args(argv)
+
+    # read, clean, and write data
+    for job in listJobs(args.basefolder):
+        convert(*job)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,16 @@
 # Only data deemed relevant for analysis have been retained, however this has been construed broadly.
 
 from os import listdir
-from os.path import isfile, join
+from os.path import basename, isfile, join
+import argparse
 import numpy as np
 import pandas
 
+from eprime_io import readColumns
+from frame_assembly import ColumnCollector
+from recode import recode
+from stage_timing import timed
+
 # turning off a warning that occurs with some chained commands.
 pandas.options.mode.chained_assignment = None
 
@@ -14,6 +20,7 @@ class Data:
     def __init__(self, dataFileName):
         self.contents = None
         self.dataFile = dataFileName
+        self.encoding = None
         self.stimuli = [HereWeGo(), Sample(), PreStimulus(), Image(), IRI()]
         self.readFields = self.__declareReadFields()
         self.writeFields = self.__declareWriteFields()
@@ -30,19 +37,21 @@ class Data:
                        'filename', 'photo_group', 'trial']
         return writeFields
 
+    @timed
     def load(self):
         try:
-            self.contents = pandas.read_csv(self.dataFile, sep='\t', usecols=self.readFields)
+            self.contents, self.encoding = readColumns(self.dataFile, self.readFields)
         except:
             raise Exception('Unable to load {}'.format(self.dataFile))
 
+    @timed
     def clean(self):
-        cleanedData = pandas.DataFrame(columns=self.writeFields)
+        collector = ColumnCollector(self.writeFields)
 
         # go through each stimuli type and reorganize data belonging to this type
         for stimType in self.stimuli:
-            stimData = stimType.clean(self.contents, self.writeFields)
-            cleanedData = pandas.concat([cleanedData, stimData])
+            collector.add(stimType.clean(self.contents, self.writeFields))
+        cleanedData = collector.assemble()
 
         # drop rows with all NA/nan values
         cleanedData.dropna(how='all', inplace=True)
@@ -50,9 +59,6 @@ class Data:
         # shift all time stamps so the experiment starts at time 0
         cleanedData = self.__shiftTime(cleanedData)
 
-        # replace all nan with 'NA'
-        cleanedData.replace(np.nan, 'NA', inplace=True)
-
         # sort by onset time
         cleanedData.sort_values(by='onset', inplace=True)
 
@@ -66,9 +72,11 @@ class Data:
 
         return data
 
+    @timed
     def write(self, outputfile):
         if self.contents is not None:
-            self.contents.to_csv(outputfile, sep='\t', index=False)
+            # missing values are written as 'NA', so the columns can keep their numeric types until here
+            self.contents.to_csv(outputfile, sep='\t', na_rep='NA', index=False)
 
 # specific types of stimuli in the task
 class HereWeGo:
@@ -94,6 +102,7 @@ class HereWeGo:
 
         self.inputFields = list(set(self.onsetField + self.durationField))
 
+    @timed
     def clean(self, rawData, outputFields):
         # extract onset time
         onset = rawData[self.onsetField].iloc[0]
@@ -145,6 +154,7 @@ class Sample:
                                     + self.reaction_timeField + self.reaction_exptimeField \
                                     + self.responseField))
 
+    @timed
     def clean(self, rawData, outputFields):
         # extract onset time
         onset = rawData[self.onsetField].iloc[0]
@@ -173,7 +183,7 @@ class Sample:
         response = [response['Sample1.RESP'], response['Sample2.RESP']]
         response = pandas.DataFrame(response, columns=['response'], dtype=str)
         responseRecodeVals = {'p': "CHANGETHIS!!", 'q': "CHANGETHIS!!"}
-        response = response.replace({'response': responseRecodeVals})
+        response = recode(response, {'response': responseRecodeVals})
 
         data = pandas.concat(
             [onset, duration, reaction_time, reaction_exptime, response], axis=1)
@@ -212,6 +222,7 @@ class PreStimulus:
         self.inputFields = list(set(self.onsetField + self.durationField \
                                     + self.trialField))
 
+    @timed
     def clean(self, rawData, outputFields):
         # extract onset time
         onset = rawData[self.onsetField]
@@ -275,6 +286,7 @@ class Image:
                                     + self.genderField + self.raceField + self.filenameField \
                                     + self.photo_groupField + self.trialField))
 
+    @timed
     def clean(self, rawData, outputFields):
         # extract onset time
         onset = rawData[self.onsetField]
@@ -295,7 +307,8 @@ class Image:
         # recode values for response
         response = rawData[self.responseField]
         responseRecodeVals = {'p': "CHANGETHIS!!", 'q': "CHANGETHIS!!"}
-        response = response.rename(columns={response.columns[0]: 'response'}).replace({'response': responseRecodeVals})
+        response = response.rename(columns={response.columns[0]: 'response'})
+        response = recode(response, {'response': responseRecodeVals})
 
         # calculate accuracy
         correct = response['response'] == rawData['CorrectAnswer']
@@ -307,9 +320,8 @@ class Image:
         # recode values for group affiliation
         group_affiliation = rawData[self.group_affiliationField]
         group_affiliationRecodeVals = {1: "ingroup", 2: "outgroup", 3: "unaffiliated"}
-        group_affiliation = group_affiliation.rename(
-            columns={group_affiliation.columns[0]: 'group_affiliation'}).replace(
-            {'group_affiliation': group_affiliationRecodeVals})
+        group_affiliation = group_affiliation.rename(columns={group_affiliation.columns[0]: 'group_affiliation'})
+        group_affiliation = recode(group_affiliation, {'group_affiliation': group_affiliationRecodeVals})
 
         # extract team membership
         team = rawData[self.teamField]
@@ -330,9 +342,8 @@ class Image:
         # recode values for photo group
         photo_group = rawData[self.photo_groupField]
         photo_groupRecodeVals = {'1': "bar", '2': "baz", 'D': "foo"}
-        photo_group = photo_group.rename(
-            columns={photo_group.columns[0]: 'photo_group'}).replace(
-            {'photo_group': photo_groupRecodeVals})
+        photo_group = photo_group.rename(columns={photo_group.columns[0]: 'photo_group'})
+        photo_group = recode(photo_group, {'photo_group': photo_groupRecodeVals})
 
         # extract trial number
         trial = rawData[self.trialField]
@@ -376,6 +387,7 @@ class IRI:
         self.inputFields = list(set(self.onsetField + self.durationField \
                                     + self.trialField))
 
+    @timed
     def clean(self, rawData, outputFields):
         # extract onset time
         onset = rawData[self.onsetField]
@@ -403,39 +415,67 @@ class IRI:
 
 
 # path to data
+# default location of the data, which can be changed with --basefolder.
+# all other folders are relative to this one.
 # note that this task has data split across several folders
 basefolder = "/mnt/magaj/SNAP/Data/Task Behavioral Data for BIDS/"
-snap1datadir1 = basefolder + "SNAP 1/Team Game/Post Scan Memory/Edat/"
-snap1datadir2 = basefolder + "SNAP 1/Team Game/Post Scan Memory/New Edat/"
+snap1datadir1 = "SNAP 1/Team Game/Post Scan Memory/Edat/"
+snap1datadir2 = "SNAP 1/Team Game/Post Scan Memory/New Edat/"
 
 # output folder
-snap1outdir = basefolder + "Converted Files/SNAP 1/Team/Post Scan Memory/"
-
-# getting list of files and their paths
-snap1files1 = [f for f in listdir(snap1datadir1) if isfile(join(snap1datadir1, f))]
-snap1files1path = [snap1datadir1 for d in snap1files1]
-snap1files2 = [f for f in listdir(snap1datadir2) if isfile(join(snap1datadir2, f))]
-snap1files2path = [snap1datadir2 for d in snap1files2]
-snap1files = snap1files1 + snap1files2
-snap1datadir = snap1files1path + snap1files2path
-
-# read, clean, and write data
-seenIDs = []
-for i, datafile in enumerate(snap1files):
-    thisData = Data(join(snap1datadir[i], datafile))
-    subjID = str(''.join(filter(str.isdigit, datafile)))
+snap1outdir = "Converted Files/SNAP 1/Team/Post Scan Memory/"
+
+
+def subjectID(datafile):
+    return str(''.join(filter(str.isdigit, datafile)))
+
+
+def listJobs(basefolder=basefolder):
+    # pair every data file with its output file across all cohorts
+    jobs = []
+    seenIDs = []
+    for datadir, outdir in [(snap1datadir1, snap1outdir), (snap1datadir2, snap1outdir)]:
+        datadir = join(basefolder, datadir)
+        outdir = join(basefolder, outdir)
+        files = [f for f in listdir(datadir) if isfile(join(datadir, f))]
+        for datafile in files:
+            subjID = subjectID(datafile)
+
+            if subjID in seenIDs:
+                # making sure there is no duplicate file as this would silently overwrite output from the first file
+                raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
+            else:
+                seenIDs.append(subjID)
+                outputfile = "sub-" + subjID.zfill(5) + "_task-team-post_run01_events.tsv"
+
+            jobs.append((join(datadir, datafile), join(outdir, outputfile)))
+
+    return jobs
+
+
+def convert(datafile, outputfile):
+    # read, clean, and write data for a single subject
+    thisData = Data(datafile)
+    subjID = subjectID(basename(datafile))
 
     try:
         thisData.load()
         thisData.clean()
+        thisData.write(outputfile)
+    except:
+        raise Exception('Unable to process subject {}'.format(subjID))
 
-        if subjID in seenIDs:
-            # making sure there is no duplicate file as this would silently overwrite output from the first file
-            raise Exception('Two file names found with the numbers {}. Rename to prevent overwriting.'.format(subjID))
-        else:
-            seenIDs.append(subjID)
-            outputfile = "sub-" + subjID.zfill(5) + "_task-team-post_run01_events.tsv"
 
-        thisData.write(join(snap1outdir, outputfile))
-    except:
-        raise Exception('Unable to process subject {}'.format(subjID))
\ No newline at end of file
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert Team Post-Task event files to BIDS tsv files.')
+    parser.add_argument('--basefolder', default=basefolder,
+                        help='folder holding the task data for each cohort and the Converted Files folder')
+    args = parser.parse_args(argv)
+
+    # read, clean, and write data
+    for job in listJobs(args.basefolder):
+        convert(*job)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+# EPRIME FILE READING
+# Helpers shared by the createTSV scripts for reading the files exported from ePrime.
+# The exports were saved with different encodings (mostly UTF-16, some UTF-8/ASCII), so the
+# encoding is picked from the first bytes of a file rather than by trial and error.
+# Parsed columns can optionally be cached as uncompressed Feather files (requires pyarrow), keyed
+# on a hash of the source file, so later runs memory-map them instead of decoding the text again.
+# The hash of each source file is kept with its size and modification time, and the file is only
+# hashed again when those change.
+
+from collections import Counter
+from os.path import isfile, join
+import codecs
+import hashlib
+import io
+import json
+import os
+import re
+import numpy as np
+import pandas
+
+from build_manifest import fileHash
+
+try:
+    import pyarrow
+    from pyarrow import feather
+except ImportError:
+    # the cache is optional
+    pyarrow = None
+
+# number of files read with each encoding (in this process)
+encodingCounts = Counter()
+
+# how many bytes to look at when there is no byte order mark
+SNIFF_SIZE = 4096
+
+# folder of the parse cache, which is off unless set with setCacheFolder()
+cacheFolder = None
+
+
+def setCacheFolder(folder):
+    global cacheFolder
+    if folder is not None:
+        if pyarrow is None:
+            raise Exception('The parse cache requires pyarrow, which is not installed')
+        os.makedirs(folder, exist_ok=True)
+    cacheFolder = folder
+
+
+def sniffEncoding(dataFile):
+    with open(dataFile, 'rb') as f:
+        encoding = detectEncoding(f.read(SNIFF_SIZE))
+
+    encodingCounts[encoding] += 1
+    return encoding
+
+
+def detectEncoding(head):
+    # byte order marks. The utf_16 codec removes the mark, unlike utf_16_le.
+    if head.startswith(codecs.BOM_UTF8):
+        encoding = 'utf_8_sig'
+    elif head.startswith(codecs.BOM_UTF16_LE) or head.startswith(codecs.BOM_UTF16_BE):
+        encoding = 'utf_16'
+    else:
+        # UTF-16 without a byte order mark: ASCII text leaves every other byte zero
+        head = head[:len(head) - len(head) % 2]
+        evenZeros = head[0::2].count(0)
+        oddZeros = head[1::2].count(0)
+        if head and oddZeros > len(head) // 4 and evenZeros == 0:
+            encoding = 'utf_16_le'
+        elif head and evenZeros > len(head) // 4 and oddZeros == 0:
+            encoding = 'utf_16_be'
+        else:
+            encoding = 'utf_8'
+
+    return encoding
+
+
+def readColumns(dataFile, fields, sep='\t'):
+    # Reads the named columns, with the encoding detected from the start of the file.
+    def read():
+        encoding = sniffEncoding(dataFile)
+        return pandas.read_csv(dataFile, sep=sep, usecols=fields, encoding=encoding), encoding
+
+    return cachedRead(dataFile, ('columns', sorted(fields), sep), read)
+
+
+def readMatchingColumns(dataFile, patterns, sep='\t'):
+    # Reads the columns whose headers match any of the regex patterns (see openMatchingColumns).
+    def read():
+        f, fields, encoding = openMatchingColumns(dataFile, patterns, sep)
+        with f:
+            contents = pandas.read_csv(f, sep=sep, usecols=fields)
+        return contents, encoding
+
+    return cachedRead(dataFile, ('matching', list(patterns), sep), read)
+
+
+def readMatchingColumnsChunked(dataFile, patterns, chunksize, sep='\t'):
+    # As readMatchingColumns, but the rows are parsed chunksize rows at a time as they are iterated,
+    # so a long file is never held in memory at once. Chunks are not cached.
+    # The header is read up front; the file is opened again for the rows only once iteration starts,
+    # and closed when the chunks are used up or the iteration is abandoned.
+    f, fields, encoding = openMatchingColumns(dataFile, patterns, sep)
+    f.close()
+
+    def chunks():
+        with open(dataFile, encoding=encoding, newline='') as f:
+            yield from pandas.read_csv(f, sep=sep, usecols=fields, chunksize=chunksize)
+
+    return chunks(), fields, encoding
+
+
+def openMatchingColumns(dataFile, patterns, sep='\t'):
+    # Opens the file once: the encoding is detected by peeking at the buffered bytes, then the
+    # header line is read from the same handle, which is rewound for parsing the matching columns.
+    # As with index_col=0, the first column (the ePrime experiment name) is never matched.
+    pattern = re.compile('|'.join(patterns))
+    raw = open(dataFile, 'rb')
+    encoding = detectEncoding(raw.peek(SNIFF_SIZE)[:SNIFF_SIZE])
+    encodingCounts[encoding] += 1
+    f = io.TextIOWrapper(raw, encoding=encoding, newline='')
+    headers = f.readline().rstrip('\r\n').split(sep)
+    fields = [s for s in headers[1:] if pattern.match(s)]
+    f.seek(0)
+    return f, fields, encoding
+
+
+def sourceHash(dataFile):
+    # the hash of the source file, reused from its stamp in the cache folder while the size and
+    # modification time are unchanged (as in build_manifest). Each source file has its own stamp,
+    # named by its path, so workers converting different files never write the same stamp.
+    st = os.stat(dataFile)
+    pathHash = hashlib.sha256(os.path.abspath(dataFile).encode()).hexdigest()
+    stampFile = join(cacheFolder, 'stamps', pathHash[:32] + '.json')
+    if isfile(stampFile):
+        with open(stampFile) as f:
+            stamp = json.load(f)
+        if stamp['size'] == st.st_size and stamp['mtime'] == st.st_mtime_ns:
+            return stamp['hash']
+
+    stamp = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'hash': fileHash(dataFile)}
+    os.makedirs(join(cacheFolder, 'stamps'), exist_ok=True)
+    tmpFile = '{}.{}.tmp'.format(stampFile, os.getpid())
+    with open(tmpFile, 'w') as f:
+        json.dump(stamp, f)
+    os.replace(tmpFile, stampFile)
+    return stamp['hash']
+
+
+def cachedRead(dataFile, key, read):
+    # read() parses dataFile and returns (contents, encoding). With the cache on, the result is
+    # stored under the hash of the source file and of the key (what was read, and how), so a
+    # changed source file or different columns are parsed again.
+    if cacheFolder is None:
+        return read()
+
+    keyHash = hashlib.sha256(repr((key, pandas.__version__)).encode()).hexdigest()
+    cacheFile = join(cacheFolder, '{}-{}.feather'.format(sourceHash(dataFile), keyHash[:16]))
+    if isfile(cacheFile):
+        table = feather.read_table(cacheFile, memory_map=True)
+        encoding = table.schema.metadata[b'encoding'].decode()
+        encodingCounts[encoding] += 1
+        contents = table.to_pandas()
+        # missing text values come back as None, but the scripts expect NaN as read_csv gives
+        for column in contents.columns[contents.dtypes == object]:
+            contents[column] = contents[column].where(contents[column].notna(), np.nan)
+        return contents, encoding
+
+    contents, encoding = read()
+    try:
+        table = pyarrow.Table.from_pandas(contents, preserve_index=False)
+    except (pyarrow.ArrowException, ValueError):
+        # columns of mixed types cannot be stored, so such files are always parsed
+        return contents, encoding
+
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'encoding'] = encoding.encode()
+    # written under a temporary name so another worker never reads a partial file
+    tmpFile = '{}.{}.tmp'.format(cacheFile, os.getpid())
+    feather.write_feather(table.replace_schema_metadata(metadata), tmpFile, compression='uncompressed')
+    os.replace(tmpFile, cacheFile)
+    return contents, encoding
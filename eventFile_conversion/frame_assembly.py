@@ -0,0 +1,50 @@
+# FRAME ASSEMBLY
+# Builds the cleaned data of a task from the data frames produced by each of its stimulus types.
+# The frames are collected while the stimuli are cleaned and their columns are joined once at the
+# end, instead of growing a data frame with pandas.concat for every stimulus type.
+# A column keeps its dtype when every stimulus type produced it with the same dtype. Otherwise
+# (different dtypes, or missing for some stimulus types) it holds the original values as objects,
+# with NaN where a stimulus type has no value, as concatenating onto an empty frame used to give.
+
+import numpy as np
+import pandas
+
+
+class ColumnCollector:
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.frames = []
+
+    def add(self, frame):
+        self.frames.append(frame)
+
+    def assemble(self):
+        # columns not declared up front are added after the declared ones, in the order they appear
+        columns = list(self.columns)
+        for frame in self.frames:
+            columns.extend(c for c in frame.columns if c not in columns)
+
+        if not self.frames:
+            return pandas.DataFrame(columns=columns)
+
+        index = self.frames[0].index.append([frame.index for frame in self.frames[1:]])
+        data = {column: self.__joinColumn(column, len(index)) for column in columns}
+        return pandas.DataFrame(data, index=index, columns=columns)
+
+    def __joinColumn(self, column, length):
+        parts = [frame[column] if column in frame.columns else None for frame in self.frames]
+        dtypes = {part.dtype for part in parts if part is not None}
+
+        if all(part is not None for part in parts) and len(dtypes) == 1:
+            if isinstance(parts[0].dtype, np.dtype):
+                return np.concatenate([part.to_numpy() for part in parts])
+            # extension dtypes (e.g. Int64) are joined by pandas
+            return pandas.concat(parts, ignore_index=True).array
+
+        values = np.full(length, np.nan, dtype=object)
+        start = 0
+        for frame, part in zip(self.frames, parts):
+            if part is not None:
+                values[start:start + len(frame)] = part.to_numpy(dtype=object)
+            start += len(frame)
+        return values
@@ -0,0 +1,65 @@
+# MANIFEST INDEX
+# The manifests (./manifests/<task>.txt) list the event files to place for each task. The index reads
+# all of them once, into a set of filenames per task and a map from (subject, task, run) to the
+# listed file, so the staging folders of every task and cohort can be reconciled against them with
+# set operations. A run of a subject that is listed twice under different names is caught here.
+
+from os.path import basename, join, splitext
+import glob
+import re
+
+# e.g. sub-01003_task-cyberball_run-1_events.tsv, sub-01003_task-team-pre_run01_events.tsv
+eventFilePattern = re.compile(r'(sub-[^_]+)_task-(.+?)_run-?(\d+)_events\.tsv')
+
+
+def eventKey(filename):
+    # (subject, task, run) of an event filename, or None if it does not follow the pattern
+    match = eventFilePattern.fullmatch(filename)
+    if match is None:
+        return None
+    subject, task, run = match.groups()
+    return subject, task, int(run)
+
+
+def readManifest(manifestFile):
+    # filenames listed in the manifest, skipping blank lines and '#' comments
+    with open(manifestFile) as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+class ManifestIndex:
+    def __init__(self, manifestfolder):
+        self.listed = {}  # task -> listed filenames, in the order of the manifest
+        self.files = {}  # task -> set of listed filenames
+        self.keys = {}  # (subject, task, run) -> listed filename
+        self.duplicates = []  # (task, filename, filename listed before it for the same subject, task and run)
+        self.unrecognized = []  # (task, filename) of listed filenames that are not event filenames
+
+        for manifestFile in sorted(glob.glob(join(manifestfolder, '*.txt'))):
+            task = splitext(basename(manifestFile))[0]
+            if task == 'EXAMPLE':
+                continue
+            self.listed[task] = readManifest(manifestFile)
+            self.files[task] = set(self.listed[task])
+
+            for filename in self.listed[task]:
+                key = eventKey(filename)
+                if key is None:
+                    self.unrecognized.append((task, filename))
+                elif key in self.keys and self.keys[key] != filename:
+                    self.duplicates.append((task, filename, self.keys[key]))
+                else:
+                    self.keys[key] = filename
+
+    def reconcile(self, task, staged):
+        # splits the filenames found in a staging folder into those listed in the task's manifest,
+        # which are to be placed, and those that are not, which are left behind
+        staged = set(staged)
+        listed = self.files.get(task, set())
+        return sorted(staged & listed), sorted(staged - listed)
+
+    def notPlaced(self, task, placed):
+        # listed filenames that are not in placed, in the order of the manifest
+        missing = self.files.get(task, set()) - set(placed)
+        return [f for f in self.listed.get(task, []) if f in missing]
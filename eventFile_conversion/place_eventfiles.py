@@ -0,0 +1,389 @@
+# PLACE EVENT FILES
+# Copies the converted event files (.tsv) from the Converted Files staging folders into the BIDS
+# hierarchy, for every task and cohort in a single invocation. Replaces move_eventfiles.sh.
+#
+# Each file is placed into BOTH the rawdata and derivatives trees:
+#   - derivatives: copied verbatim; the converted files already use the unpadded run label
+#                  fMRIPrep produces (run-1, run-2)
+#   - rawdata:     the run label is zero-padded (run-1 -> run-01) to match the bold filenames
+# Both copies are required: the BIDS Inheritance Principle does not cross dataset boundaries.
+# The staging copy is left untouched.
+#
+# The manifest of a task (./manifests/<task>.txt) is a WHITELIST of the files to place, and only
+# tasks with a manifest are placed:
+#   - a file listed in the manifest and found in staging is placed;
+#   - a file found in staging but NOT listed is reported and left untouched;
+#   - a file listed in the manifest but not placed is reported as NOT PLACED, whether it was
+#     never found in staging or was found but could not be placed.
+# All manifests are read once into an index (see manifest_index.py), and each staging folder is
+# reconciled against it with set operations. With --report, the outcome for every file is also
+# written to a JSON file.
+#
+# Every copy is written to a temporary file next to its destination, given its final owner, group
+# and permissions (group read/write, no world access), checked against the checksum of the staging
+# file and only then renamed into place. So nothing is placed without its final permissions, and
+# if the script is run without sudo the chown fails before anything is written into the BIDS tree.
+# Destinations that already hold identical contents are not copied again.
+# Copies to both trees run concurrently in a pool of threads, which is where the time goes on the
+# network mount.
+#
+# When staging and the BIDS datasets are on the same filesystem, --link avoids writing the bytes
+# of every copy again:
+#   - reflink:  both copies are reflinks (copy-on-write clones) of the staging file, separate files
+#               that share the data blocks until either is changed
+#   - hardlink: the rawdata copy is a reflink of the staging file, and the derivatives copy is a
+#               hard link to the rawdata copy (same contents, only the name differs), so the two
+#               share one inode. The staging file is never linked, as it keeps its own permissions.
+# Where the filesystem does not support it, the file is copied as usual.
+#
+# Exits non-zero if any listed file was NOT PLACED, if a target func/ directory was missing, or if
+# a staging directory was missing. Files left behind on purpose do not affect the exit code.
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from os.path import basename, dirname, abspath, isdir, isfile, join
+import argparse
+import json
+import errno
+import fcntl
+import grp
+import importlib
+import os
+import pwd
+import re
+import shutil
+import stat
+import tempfile
+
+from build_manifest import fileHash
+from convert_all import TASKS
+from manifest_index import ManifestIndex, eventKey
+
+# Owner and group applied to every placed file.
+OWNER = 'dummy-user'
+GROUP = 'fslab-snap'
+
+# Default locations, which can be changed with --basefolder and --bidsfolder.
+basefolder = '/g/Imaging/SNAP/Data/Task Behavioral Data for BIDS/'
+bidsfolder = '/g/Imaging/SNAP/Data/BIDS/SNAP/'
+manifestfolder = join(dirname(abspath(__file__)), 'manifests')
+
+# ioctl request to clone a file's data blocks (linux/fs.h), supported on btrfs and XFS among others
+FICLONE = 0x40049409
+
+
+def stagingFolders(task):
+    # cohort number -> staging folder (relative to the basefolder), as set in the task script
+    # as snap1outdir, snap2outdir, ...
+    module = importlib.import_module(TASKS[task])
+    folders = {}
+    for name, value in vars(module).items():
+        match = re.fullmatch(r'snap(\d)outdir', name)
+        if match:
+            folders[int(match.group(1))] = value
+    return dict(sorted(folders.items()))
+
+
+def bidsFolders(bidsfolder, cohort):
+    # the rawdata and derivatives roots of a cohort; subject folders already exist under each
+    return (join(bidsfolder, 'rawdata', 'SNAP{}'.format(cohort)),
+            join(bidsfolder, 'derivatives', 'fmriprep-SNAP{}'.format(cohort)))
+
+
+def destinations(filename, rawdataRoot, derivativesRoot):
+    # REQUIRES sub-<val> to be the first entity in the filename.
+    subject = filename.split('_')[0]
+    # a single-digit run label is zero-padded (run-1 -> run-01), one already padded is kept
+    rawdataName = re.sub(r'_run-(\d)_', r'_run-0\1_', filename, count=1)
+    return [join(rawdataRoot, subject, 'func', rawdataName),
+            join(derivativesRoot, subject, 'func', filename)]
+
+
+def placedMode(mode):
+    # owner permissions as they are, group read/write, no world access
+    return (stat.S_IMODE(mode) | stat.S_IRGRP | stat.S_IWGRP) & ~stat.S_IRWXO
+
+
+def cloneFile(source, destination):
+    # reflinks the destination to the source where the filesystem supports it, otherwise copies
+    # returns whether a reflink was made
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+                raise
+    shutil.copyfile(source, destination)
+    return False
+
+
+def temporaryFile(destination):
+    # a new, empty file next to the destination, under a name no other copy can be using
+    fd, tmpFile = tempfile.mkstemp(prefix='.' + basename(destination) + '.', suffix='.tmp', dir=dirname(destination))
+    os.close(fd)
+    return tmpFile
+
+
+def placeFile(source, sourceHash, destination, uid, gid, reflink=False):
+    # returns 'unchanged' if the destination already held the same contents, otherwise 'reflinked'
+    # or 'copied'
+    mode = placedMode(os.stat(source).st_mode)
+
+    if isfile(destination) and fileHash(destination) == sourceHash:
+        st = os.stat(destination)
+        if (st.st_uid, st.st_gid) != (uid, gid):
+            os.chown(destination, uid, gid)
+        if stat.S_IMODE(st.st_mode) != mode:
+            os.chmod(destination, mode)
+        return 'unchanged'
+
+    tmpFile = temporaryFile(destination)
+    try:
+        if reflink:
+            reflinked = cloneFile(source, tmpFile)
+        else:
+            shutil.copyfile(source, tmpFile)
+            reflinked = False
+        shutil.copystat(source, tmpFile)
+        os.chown(tmpFile, uid, gid)
+        os.chmod(tmpFile, mode)
+        if fileHash(tmpFile) != sourceHash:
+            raise Exception('Checksum of the copy does not match {}'.format(source))
+        os.replace(tmpFile, destination)
+    finally:
+        if isfile(tmpFile):
+            os.remove(tmpFile)
+    return 'reflinked' if reflinked else 'copied'
+
+
+def linkFile(existing, destination):
+    # hard links the destination to an already placed file with the same contents
+    # returns 'unchanged' if it already was, otherwise 'hardlinked'; raises OSError where the two
+    # are on different filesystems or hard links are not supported
+    if isfile(destination) and os.path.samefile(existing, destination):
+        return 'unchanged'
+
+    # the link needs a name that does not exist yet
+    tmpFile = temporaryFile(destination)
+    os.remove(tmpFile)
+    try:
+        os.link(existing, tmpFile)
+        os.replace(tmpFile, destination)
+    finally:
+        if isfile(tmpFile):
+            os.remove(tmpFile)
+    return 'hardlinked'
+
+
+def placeLinked(source, sourceHash, targets, uid, gid):
+    # --link hardlink: the first target is placed from the source, the others are hard links to it
+    # returns the outcome for each target
+    outcomes = [placeFile(source, sourceHash, targets[0], uid, gid, reflink=True)]
+    for target in targets[1:]:
+        # an identical file is left as it is, rather than replaced by a link
+        if isfile(target) and not os.path.samefile(targets[0], target) and fileHash(target) == sourceHash:
+            outcomes.append(placeFile(source, sourceHash, target, uid, gid))
+            continue
+        try:
+            outcomes.append(linkFile(targets[0], target))
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            outcomes.append(placeFile(source, sourceHash, target, uid, gid, reflink=True))
+    return outcomes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Place converted event files into the BIDS hierarchy.')
+    parser.add_argument('tasks', nargs='*', metavar='task',
+                        help='tasks to place (default: all tasks with a manifest). One of: ' + ', '.join(sorted(TASKS)))
+    parser.add_argument('--basefolder', default=basefolder, help='folder holding the Converted Files folder')
+    parser.add_argument('--bidsfolder', default=bidsfolder, help='folder holding the rawdata and derivatives datasets')
+    parser.add_argument('--dry-run', action='store_true', help='report what would be placed without changing anything')
+    parser.add_argument('-j', '--workers', type=int, default=16, help='number of files copied at the same time')
+    parser.add_argument('--owner', default=OWNER, help='owner of the placed files')
+    parser.add_argument('--group', default=GROUP, help='group of the placed files')
+    parser.add_argument('--link', choices=['reflink', 'hardlink'], default=None,
+                        help='place files as reflinks of the staging file, or additionally hard link the '
+                             'derivatives copy to the rawdata copy, where the filesystem allows')
+    parser.add_argument('--report', default=None,
+                        help='also write the outcome for every file, and the summary, to this JSON file')
+    args = parser.parse_args(argv)
+
+    # task names are accepted in any case, e.g. 'Cyberball'
+    tasks = [t.lower() for t in args.tasks]
+    unknown = [t for t in tasks if t not in TASKS]
+    if unknown:
+        parser.error('unknown task(s): ' + ', '.join(unknown))
+    index = ManifestIndex(manifestfolder)
+    withManifest = [t for t in sorted(TASKS) if t in index.files]
+    missing = [t for t in tasks if t not in withManifest]
+    if missing:
+        parser.error('no manifest in {} for: {}'.format(manifestfolder, ', '.join(missing)))
+    tasks = tasks or withManifest
+
+    if not args.dry_run:
+        # looked up before anything is copied, so an unknown owner or group stops the run at once
+        try:
+            uid, gid = pwd.getpwnam(args.owner).pw_uid, grp.getgrnam(args.group).gr_gid
+        except KeyError as e:
+            parser.error('unknown owner or group: {}'.format(e))
+
+    print('{}Tasks: {}'.format('DRY RUN - nothing will be changed. ' if args.dry_run else '', ', '.join(tasks)))
+
+    # find the files to place, and what cannot be placed
+    placements = []  # (task, filename, source, destinations)
+    leftBehind = []
+    errors = []
+    # one record per file for the report
+    records = {}  # (task, filename) -> record
+
+    # the same run of a subject listed twice would be placed twice to the same rawdata file, so
+    # neither entry is placed
+    duplicates = set()
+    for task, filename, previous in index.duplicates:
+        if task in tasks:
+            errors.append('listed twice for the same subject and run: {} and {}'.format(previous, filename))
+            duplicates.update([(task, filename), (task, previous)])
+    for task, filename in index.unrecognized:
+        if task in tasks:
+            errors.append('not an event filename (sub-<id>_task-<task>_run-<n>_events.tsv): {}'.format(filename))
+
+    for task in tasks:
+        for cohort, outdir in stagingFolders(task).items():
+            stagingDir = join(args.basefolder, outdir)
+            if not isdir(stagingDir):
+                errors.append('staging directory not found: {}'.format(stagingDir))
+                continue
+
+            staged = [f for f in os.listdir(stagingDir) if f.endswith('.tsv') and isfile(join(stagingDir, f))]
+            toPlace, notListed = index.reconcile(task, staged)
+            for filename in notListed:
+                leftBehind.append(join(stagingDir, filename))
+                records[(task, filename)] = {'status': 'left behind', 'source': join(stagingDir, filename)}
+
+            rawdataRoot, derivativesRoot = bidsFolders(args.bidsfolder, cohort)
+            for filename in toPlace:
+                # The subject directories already exist. If one is missing, that is a real problem
+                # with the data, not something to paper over by creating a directory.
+                targets = destinations(filename, rawdataRoot, derivativesRoot)
+                missingDirs = [dirname(t) for t in targets if not isdir(dirname(t))]
+                for d in missingDirs:
+                    errors.append('no such directory, skipping: {}'.format(d))
+                records[(task, filename)] = {'source': join(stagingDir, filename), 'destinations': targets}
+                if (task, filename) in duplicates:
+                    records[(task, filename)]['detail'] = 'duplicate run'
+                elif missingDirs:
+                    records[(task, filename)]['detail'] = 'missing: ' + ', '.join(missingDirs)
+                else:
+                    placements.append((task, filename, join(stagingDir, filename), targets))
+
+    # copy to both trees at once
+    placed = {task: set() for task in tasks}
+    counts = Counter()
+    if args.dry_run:
+        for task, filename, source, targets in placements:
+            print('  WOULD PLACE: ' + source)
+            for target in targets:
+                print('      -> ' + target)
+            placed[task].add(filename)
+            records[(task, filename)]['status'] = 'would place'
+    else:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            sourceHashes = dict(zip((p[2] for p in placements), executor.map(fileHash, (p[2] for p in placements))))
+            if args.link == 'hardlink':
+                # the derivatives copy is linked to the rawdata copy, so both are placed in one job
+                futures = [(task, filename, source, [executor.submit(placeLinked, source, sourceHashes[source],
+                                                                     targets, uid, gid)])
+                           for task, filename, source, targets in placements]
+            else:
+                futures = [(task, filename, source, [executor.submit(placeFile, source, sourceHashes[source], target,
+                                                                     uid, gid, args.link == 'reflink')
+                                                     for target in targets])
+                           for task, filename, source, targets in placements]
+            try:
+                for task, filename, source, results in futures:
+                    outcomes = []
+                    for future in results:
+                        result = future.result()
+                        outcomes.extend(result if isinstance(result, list) else [result])
+                    counts.update(outcomes)
+                    changed = [o for o in outcomes if o != 'unchanged']
+                    print('  {}: {}'.format(changed[0].upper() if changed else 'UNCHANGED', source))
+                    placed[task].add(filename)
+                    records[(task, filename)].update({'status': 'placed', 'outcomes': outcomes})
+            except BaseException:
+                # a failed copy (e.g. chown without sudo) stops the run, as a serial copy would
+                executor.shutdown(cancel_futures=True)
+                raise
+
+    # report
+    print('')
+    print('=== Staging files not in manifest, left alone')
+    for f in leftBehind:
+        print('  LEFT BEHIND: ' + f)
+    if not leftBehind:
+        print('  (none)')
+
+    print('')
+    print('=== Errors')
+    for e in errors:
+        print('  ERROR: ' + e)
+    if not errors:
+        print('  (none)')
+
+    # A listed file lands here for either reason: it was never found in staging, or it was found
+    # but could not be placed (see the errors above).
+    notPlaced = [(task, f) for task in tasks for f in index.notPlaced(task, placed[task])]
+    print('')
+    print('=== Manifest entries not placed')
+    for task, f in notPlaced:
+        print('  NOT PLACED: {}: {}'.format(task, f))
+    if not notPlaced:
+        print('  (none)')
+
+    print('')
+    print('=== Summary')
+    print('  event files placed:                        {}'.format(sum(len(p) for p in placed.values())))
+    if not args.dry_run:
+        print('  copies written:                            {}'.format(counts['copied']))
+        if args.link:
+            print('  copies reflinked:                          {}'.format(counts['reflinked']))
+            print('  copies hard linked:                        {}'.format(counts['hardlinked']))
+        print('  copies already identical:                  {}'.format(counts['unchanged']))
+    print('  staging files not in manifest, left alone: {}'.format(len(leftBehind)))
+    print('  manifest entries not placed:               {}'.format(len(notPlaced)))
+    print('  errors:                                    {}'.format(len(errors)))
+
+    if args.report:
+        for task, filename in notPlaced:
+            duplicate = (task, filename) in duplicates
+            records.setdefault((task, filename), {})['status'] = 'not placed: duplicate run' if duplicate else 'not placed'
+        files = []
+        for (task, filename), record in sorted(records.items()):
+            subject, _, run = eventKey(filename) or (None, None, None)
+            files.append({'task': task, 'file': filename, 'subject': subject, 'run': run, **record})
+        report = {
+            'dry_run': args.dry_run,
+            'tasks': tasks,
+            'summary': {
+                'placed': sum(len(p) for p in placed.values()),
+                'left_behind': len(leftBehind),
+                'not_placed': len(notPlaced),
+                'errors': len(errors),
+                'copies': dict(counts),
+            },
+            'errors': errors,
+            'files': files,
+        }
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    # A file listed but never placed, or a missing directory, means the run did not do what the
+    # manifest asked for. Files left behind on purpose are not errors.
+    return 1 if notPlaced or errors else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
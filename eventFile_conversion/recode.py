@@ -0,0 +1,63 @@
+# RECODING
+# Recodes the raw ePrime values of a column (e.g. button numbers, condition codes) to their labels.
+# Each distinct value is looked up once and the column is kept as a categorical whose categories are
+# the labels of the mapping, rather than replacing values row by row with DataFrame.replace.
+# As with replace, values the mapping does not cover are kept unchanged (as extra categories), and
+# a value mapped to NaN becomes missing. unmappedValues() lists those values for all columns at once.
+# recode() reports them too, so an unexpected ePrime code does not pass silently into the output:
+# by default with an UnmappedValuesWarning, or as an error with onUnmapped='raise'. Mappings that only
+# replace a few values and are meant to keep the others (e.g. blanks to NaN) use onUnmapped='keep'.
+
+import warnings
+import numpy as np
+import pandas
+
+
+class UnmappedValuesWarning(UserWarning):
+    pass
+
+
+def recodeColumn(values, mapping):
+    # returns the recoded column and the (non-missing) values the mapping does not cover
+    codes, uniques = pandas.factorize(values)
+    labels = [mapping.get(u, u) for u in uniques]
+    unmapped = [u for u in uniques if u not in mapping]
+
+    # the labels of the mapping come first, so a column has the same categories for every subject
+    categories = pandas.Series(list(mapping.values()) + labels, dtype=object).dropna().unique()
+    categories = pandas.Index(categories, dtype=object)
+
+    # the extra -1 keeps missing values (code -1) missing
+    labelCodes = np.append(categories.get_indexer(labels), -1)
+    recoded = pandas.Categorical.from_codes(labelCodes[codes], categories)
+    return pandas.Series(recoded, index=values.index, name=values.name), unmapped
+
+
+def recode(data, spec, onUnmapped='warn'):
+    # spec: column name -> mapping of raw value to label
+    # onUnmapped: 'warn', 'raise' or 'keep', what to do about values the mappings do not cover
+    # (found from the distinct values factorized for the recoding, so checking costs nothing extra)
+    data = data.copy()
+    unmapped = {}
+    for column, mapping in spec.items():
+        data[column], values = recodeColumn(data[column], mapping)
+        if values:
+            unmapped[column] = values
+
+    if unmapped and onUnmapped != 'keep':
+        message = 'Values not accounted for in recoding, kept unchanged: {}'.format(
+            '; '.join('{}: {}'.format(column, values) for column, values in unmapped.items()))
+        if onUnmapped == 'raise':
+            raise Exception(message)
+        warnings.warn(message, UnmappedValuesWarning, stacklevel=2)
+    return data
+
+
+def unmappedValues(data, spec):
+    # the (non-missing) values of each column that its mapping does not cover
+    unmapped = {}
+    for column, mapping in spec.items():
+        values = [v for v in data[column].dropna().unique() if v not in mapping]
+        if values:
+            unmapped[column] = values
+    return unmapped
@@ -0,0 +1,28 @@
+# REFERENCE DATA
+# Cache for lookup tables read from files that are the same for every subject (e.g. the DotProbe
+# word pair list). A task registers a function that builds its table from a file, and the table is
+# then built once per process and shared by every Data object, until the file is modified.
+
+from os.path import abspath
+import os
+
+# table name -> function building the table from a file
+tableBuilders = {}
+
+# (table name, file) -> (modification time of the file, table)
+tableCache = {}
+
+
+def registerTable(name, build):
+    tableBuilders[name] = build
+
+
+def loadTable(name, path):
+    if name not in tableBuilders:
+        raise Exception('No reference table registered as {}'.format(name))
+
+    key = (name, abspath(path))
+    mtime = os.stat(path).st_mtime_ns
+    if key not in tableCache or tableCache[key][0] != mtime:
+        tableCache[key] = (mtime, tableBuilders[name](path))
+    return tableCache[key][1]
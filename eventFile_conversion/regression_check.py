@@ -0,0 +1,144 @@
+# REGRESSION CHECK
+# Converts a fixed corpus of synthetic ePrime exports (see synthetic_eprime.py) with every createTSV
+# script and compares the output byte for byte with the stored golden files in ./golden_outputs.
+# It also records the conversion time (the median of several runs over a larger synthetic corpus) and
+# peak memory (RSS) of each task, and fails when an output changed or a task got slower than the stored
+# baseline by more than the threshold, both relative and in seconds.
+# After an intended change to the output (checked by hand), or on a new machine, re-record with --update.
+
+from concurrent.futures import ProcessPoolExecutor
+from os.path import basename, dirname, abspath, isfile, join
+import argparse
+import importlib
+import json
+import os
+import resource
+import statistics
+import tempfile
+import time
+import warnings
+
+from convert_all import TASKS
+from synthetic_eprime import EXPORTS, writeExports
+
+goldenfolder = join(dirname(abspath(__file__)), 'golden_outputs')
+baselineFile = join(goldenfolder, 'performance.json')
+
+# the fixed corpus compared with the golden files
+SUBJECTS = 3
+LENGTH = 2
+
+# the corpus that is timed, large enough that a run takes about a second rather than a few milliseconds
+TIMING_SUBJECTS = 8
+TIMING_LENGTH = 4
+
+
+def runTask(task, datafiles, outfolder, timingFiles, timingFolder, repeat):
+    # runs in its own process, so the peak memory is that of this task alone
+    warnings.simplefilter('ignore')
+    module = importlib.import_module(TASKS[task])
+    os.makedirs(outfolder, exist_ok=True)
+    os.makedirs(timingFolder, exist_ok=True)
+
+    for datafile in datafiles:
+        module.convert(datafile, join(outfolder, basename(datafile) + '.tsv'))
+
+    # median of repeat runs over all files of the timing corpus
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for datafile in timingFiles:
+            module.convert(datafile, join(timingFolder, basename(datafile) + '.tsv'))
+        times.append(time.perf_counter() - start)
+    seconds = statistics.median(times)
+
+    # kilobytes on Linux
+    peakRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return seconds, peakRSS
+
+
+def compareOutputs(task, outfolder):
+    # returns the converted files that differ from (or are missing in) the golden files
+    changed = []
+    goldenTaskFolder = join(goldenfolder, task)
+    names = set(os.listdir(outfolder)) | set(os.listdir(goldenTaskFolder) if os.path.isdir(goldenTaskFolder) else [])
+    for name in sorted(names):
+        output, golden = join(outfolder, name), join(goldenTaskFolder, name)
+        if not isfile(output) or not isfile(golden):
+            changed.append(name)
+            continue
+        with open(output, 'rb') as f1, open(golden, 'rb') as f2:
+            if f1.read() != f2.read():
+                changed.append(name)
+    return changed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the createTSV outputs and speed with the stored golden files.')
+    parser.add_argument('tasks', nargs='*', metavar='task',
+                        help='tasks to check (default: all). One of: ' + ', '.join(sorted(EXPORTS)))
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of each task, the median is kept')
+    parser.add_argument('--threshold', type=float, default=0.3,
+                        help='allowed slowdown relative to the baseline (default: 0.3, i.e. 30%%)')
+    parser.add_argument('--min-slowdown', type=float, default=0.05,
+                        help='a task only fails as slower if it also takes this many seconds longer (default: 0.05)')
+    parser.add_argument('--update', action='store_true',
+                        help='store the current outputs and performance as the new golden files and baseline')
+    args = parser.parse_args(argv)
+
+    unknown = [t for t in args.tasks if t not in EXPORTS]
+    if unknown:
+        parser.error('unknown task(s): ' + ', '.join(unknown))
+    tasks = args.tasks or sorted(EXPORTS)
+
+    baseline = {}
+    if isfile(baselineFile):
+        with open(baselineFile) as f:
+            baseline = json.load(f)
+
+    failures = []
+    with tempfile.TemporaryDirectory() as folder:
+        files = writeExports(join(folder, 'exports'), tasks, SUBJECTS, LENGTH)
+        timingFiles = writeExports(join(folder, 'timing'), tasks, TIMING_SUBJECTS, TIMING_LENGTH)
+
+        print('{:<10} {:>8} {:>10} {:>10} {:>10}  {}'.format('task', 'output', 'seconds', 'baseline', 'peak MB', ''))
+        for task in tasks:
+            outfolder = join(goldenfolder, task) if args.update else join(folder, 'converted', task)
+            # a fresh process for each task
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                seconds, peakRSS = executor.submit(runTask, task, files[task], outfolder, timingFiles[task],
+                                                   join(folder, 'timed', task), args.repeat).result()
+
+            if args.update:
+                baseline[task] = {'seconds': seconds, 'peak_rss_kb': peakRSS}
+                status, previous = 'stored', seconds
+            else:
+                changed = compareOutputs(task, outfolder)
+                previous = baseline.get(task, {}).get('seconds')
+                status = 'ok'
+                if changed:
+                    status = 'CHANGED: ' + ', '.join(changed)
+                    failures.append(task)
+                elif previous and seconds > previous * (1 + args.threshold) and seconds - previous > args.min_slowdown:
+                    status = 'SLOWER'
+                    failures.append(task)
+
+            print('{:<10} {:>8} {:>10.3f} {:>10} {:>10.1f}  {}'.format(
+                task, len(files[task]), seconds, '{:.3f}'.format(previous) if previous else '-',
+                peakRSS / 1024, status))
+
+    if args.update:
+        with open(baselineFile, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print('Stored golden outputs and baseline in {}.'.format(goldenfolder))
+        return 0
+
+    if failures:
+        print('Regression check failed for: ' + ', '.join(failures))
+        return 1
+    print('All outputs match the golden files.')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
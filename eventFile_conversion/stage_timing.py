@@ -0,0 +1,82 @@
+# STAGE TIMING
+# Records how long each stage of a conversion takes (loading, the clean of each stimulus type, the
+# Cyberball clean-up passes, writing) and how many rows of data it left, to find where the time goes
+# and to spot regressions. Methods are marked with @timed. convert_all collects the timings of each
+# subject, writes them to a JSON-lines log and prints a summary table for the batch.
+# The time of a stage excludes the timed stages it calls (e.g. Data.clean calls the clean of each
+# stimulus type), so every second is counted once and the stages add up to the conversion time.
+# Nothing is recorded unless startTimings() was called, so converting outside convert_all keeps no timings.
+
+from collections import defaultdict
+from functools import wraps
+import time
+import pandas
+
+# timings recorded in this process since the last call to startTimings()
+timings = []
+recording = False
+
+# time taken by the timed stages called from each running timed stage, innermost last
+nestedSeconds = []
+
+
+def timed(method):
+    @wraps(method)
+    def timedMethod(self, *args, **kwargs):
+        if not recording:
+            return method(self, *args, **kwargs)
+
+        nestedSeconds.append(0.0)
+        start = time.perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = nestedSeconds.pop()
+            if nestedSeconds:
+                nestedSeconds[-1] += elapsed
+        seconds = elapsed - nested
+
+        # rows of the data frame returned, otherwise of the data frame checked (e.g. a validation),
+        # otherwise of the object's contents (e.g. after Data.load)
+        frames = [a for a in (result,) + args if isinstance(a, pandas.DataFrame)]
+        data = frames[0] if frames else getattr(self, 'contents', None)
+        rows = len(data) if isinstance(data, pandas.DataFrame) else None
+        timings.append({'stage': method.__qualname__, 'seconds': seconds, 'rows': rows})
+        return result
+
+    return timedMethod
+
+
+def startTimings():
+    # starts recording, with an empty list (e.g. for each file converted)
+    global timings, recording
+    timings, recording = [], True
+
+
+def takeTimings():
+    # returns the timings recorded since startTimings() and stops recording
+    global timings, recording
+    taken, timings, recording = timings, [], False
+    return taken
+
+
+def summarize(records):
+    # records are the per-subject log entries, with the task and its list of stage timings
+    # returns the lines of a table with the calls, seconds and rows of each stage, by task
+    totals = defaultdict(lambda: {'calls': 0, 'seconds': 0.0, 'max': 0.0, 'rows': 0})
+    for record in records:
+        for stage in record['stages']:
+            total = totals[(record['task'], stage['stage'])]
+            total['calls'] += 1
+            total['seconds'] += stage['seconds']
+            total['max'] = max(total['max'], stage['seconds'])
+            total['rows'] += stage['rows'] or 0
+
+    lines = ['{:<10} {:<36} {:>6} {:>9} {:>9} {:>9} {:>9}'.format(
+        'task', 'stage', 'calls', 'total s', 'mean s', 'max s', 'rows')]
+    for (task, stage), total in sorted(totals.items(), key=lambda item: (item[0][0], -item[1]['seconds'])):
+        lines.append('{:<10} {:<36} {:>6} {:>9.3f} {:>9.4f} {:>9.4f} {:>9}'.format(
+            task, stage, total['calls'], total['seconds'], total['seconds'] / total['calls'],
+            total['max'], total['rows']))
+    return lines
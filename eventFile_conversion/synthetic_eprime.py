@@ -0,0 +1,293 @@
+# SYNTHETIC EPRIME EXPORTS
+# Writes made-up ePrime exports for every task, with the columns each createTSV script reads, so the
+# converters can be run and benchmarked without the SNAP data. The values are random but follow the
+# structure of the real exports: Procedure-suffixed column families, responses in either the
+# stimulus or the jitter period, multi-image Cyberball throws, UTF-16 and UTF-8 encodings, and
+# both spellings of Cyberball's throw pattern header.
+# The data are not meant to be analysed, only to exercise the conversion code.
+
+from os.path import join
+import argparse
+import os
+import random
+import zlib
+import numpy as np
+import pandas
+
+
+def cyberballExport(rng, length=1):
+    # rounds: getready1, throws (inclusion), rest1, getready2, throws (exclusion), rest2, rest4
+    # everything except the throws is recorded in the first row only
+    nthrows = 60 * length
+    first = {'ExperimentName': 'Cyberball'}
+    throwRows = []
+    decisions = []
+    patternHeader = rng.choice(['RunningBlock', 'Running[Block]'])
+
+    def throws(t, n, exclusion, block, pattern):
+        holder = 1
+        for i in range(n):
+            if holder == 2:
+                # the subject decides who to throw to
+                decisions.append((t, t + 500, rng.choice([2, 7]), 400, t + 400))
+                t += 500
+                target = 1 if rng.random() < .5 else 3
+            elif exclusion:
+                target = 3 if holder == 1 else 1
+            else:
+                target = 2 if rng.random() < .6 else (3 if holder == 1 else 1)
+
+            # each throw is shown as a short sequence of images
+            for k in range(rng.randint(2, 5)):
+                throwRows.append({'filename': '{}to{}.{}.bmp'.format(holder, target, k + 1),
+                                  'MyImageDisplay.OnsetTime': t, 'MyImageDisplay.OffsetTime': t + 100 + k,
+                                  'Block': block, patternHeader: pattern})
+                t += 100 + k
+            holder = target
+        return t
+
+    t = 1000
+    first['getready1.OnsetTime'], first['getready1.OffsetTime'] = t, t + 2000
+    t = throws(t + 2000, nthrows // 2, False, 1, 'throwA')
+    first['rest1.OnsetTime'], first['rest1.OffsetTime'] = t, t + 3000
+    t += 3000
+    first['getready2.OnsetTime'], first['getready2.OffsetTime'] = t, t + 2000
+    t = throws(t + 2000, nthrows // 2, True, 2, 'throwB')
+    first['rest2.OnsetTime'], first['rest2.OffsetTime'] = t, t + 3000
+    t += 3000
+    first['rest4.OnsetTime'], first['rest4.OffsetTime'] = t, t + 3000
+
+    # some decisions have no response, so their response columns are not exported
+    for i, (onset, offset, response, rt, rtTime) in enumerate(decisions[:9]):
+        first['ImageDisplay{}.OnsetTime'.format(i + 1)] = onset
+        first['ImageDisplay{}.OffsetTime'.format(i + 1)] = offset
+        if i % 4 != 3:
+            first['ImageDisplay{}.RESP'.format(i + 1)] = response
+            first['ImageDisplay{}.RT'.format(i + 1)] = rt
+            first['ImageDisplay{}.RTTime'.format(i + 1)] = rtTime
+
+    data = pandas.DataFrame(throwRows)
+    for column, value in first.items():
+        data[column] = value if column == 'ExperimentName' else np.nan
+        data.loc[0, column] = value
+    return data[['ExperimentName'] + [c for c in data.columns if c != 'ExperimentName']]
+
+
+def dotprobeExport(rng, length=1):
+    wordPairs = [('accepted', 'headline', 'pos'), ('insecure', 'upstairs', 'neg'),
+                 ('electronic', 'helicopter', 'neu'), ('worthy', 'stairs', 'neu')]
+    rows = []
+    t = 5000
+    for i in range(40 * length):
+        word1, word2, valence = wordPairs[i % len(wordPairs)]
+        if rng.random() < .5:
+            word1, word2 = word2, word1
+        row = {'ExperimentName': 'DotProbe', 'GetReady.OnsetTime': 1000, 'Words.OnsetTime': t,
+               'Words.Duration': 500, 'Prb.OnsetTime': t + 500, 'Prb.Duration': 1000,
+               'Probe_RL': rng.choice('rl'), 'Cue_RL': rng.choice('rl'), 'congruent': rng.choice('ic'),
+               'word1': word1, 'word2': word2, 'trialtype': valence, 'Trial': i + 1}
+        # response during the probe, during the jitter, or none
+        if i % 3 == 0:
+            row.update({'Prb.RESP': rng.choice([2, 7, 3]), 'Prb.RT': rng.randint(200, 900),
+                        'jitter.RT': 0, 'jitter.RESP': np.nan})
+        elif i % 3 == 1:
+            row.update({'Prb.RESP': np.nan, 'Prb.RT': 0,
+                        'jitter.RT': rng.randint(50, 500), 'jitter.RESP': rng.choice([2, 7, 8])})
+        else:
+            row.update({'Prb.RESP': np.nan, 'Prb.RT': 0, 'jitter.RT': 0, 'jitter.RESP': np.nan})
+        rows.append(row)
+        t += 3000
+    return pandas.DataFrame(rows)
+
+
+def gonogoExport(rng, length=1):
+    # five blocks, each run by its own procedure (Image, Image1, ... Image4)
+    trialsPerBlock = 8 * length
+    sets = ['Neg1S', 'Pos1S', 'Neg1', 'Pos2', 'Neg3']
+    rows = []
+    t = 1000
+    for block in range(5):
+        suffix = '' if block == 0 else str(block)
+        hereWeGo = t
+        t += 3000
+        for j in range(trialsPerBlock):
+            row = {'ExperimentName': 'GoNoGo', 'HereWeGo{}.OnsetTime'.format(suffix): hereWeGo,
+                   'Interblock{}.OnsetTime'.format(suffix): hereWeGo + 3000 + trialsPerBlock * 800,
+                   'Image{}.OnsetTime'.format(suffix): t, 'Letter{}.OnsetTime'.format(suffix): t + 300,
+                   'Valence': rng.choice(['NS', 'PS', 'P', 'N']), 'Go_NoGo': rng.choice([0, 1]),
+                   'Image': 'img\\{}_{}.bmp'.format(block, j), 'Letter': rng.choice('XY'),
+                   'Procedure[Trial]': sets[block], 'SubTrial': j + 1, 'Trial': block + 1}
+            if rng.random() < .6:
+                rt = rng.randint(100, 400)
+                row.update({'Letter{}.RESP'.format(suffix): 2, 'Letter{}.RT'.format(suffix): rt,
+                            'Letter{}.RTTime'.format(suffix): t + 300 + rt})
+            else:
+                row.update({'Letter{}.RT'.format(suffix): 0, 'Letter{}.RTTime'.format(suffix): 0})
+            rows.append(row)
+            t += 800
+        t += 7000
+
+    data = pandas.DataFrame(rows)
+    for family, fields in [('HereWeGo', ['OnsetTime']), ('Interblock', ['OnsetTime']), ('Image', ['OnsetTime']),
+                           ('Letter', ['OnsetTime', 'RESP', 'RT', 'RTTime'])]:
+        for suffix in ['', '1', '2', '3', '4']:
+            for field in fields:
+                column = '{}{}.{}'.format(family, suffix, field)
+                if column not in data.columns:
+                    data[column] = np.nan
+    return data
+
+
+def drivingExport(rng, length=1):
+    # blank cells are exported as a single space; rows are not in time order
+    rows = []
+    t = 100
+    for i in range(20 * length):
+        kind = rng.choice(['red', 'cra', 'Bra'])
+        rows.append({'DriveOnset': t, 'YellowOnset': t + 1000, 'DecisionOnset': t + 1500,
+                     'RedOnset': t + 2000 if kind != 'Bra' else ' ', 'CrashOnset': t + 2500 if kind == 'cra' else ' ',
+                     'TrialTypeWord': rng.choice(['Go', 'Stop']), 'DecisionEventName': rng.choice(['Go', 'Brake']),
+                     'RedEventName': kind, 'CrashEventName': rng.choice(['Crash', 'NoCrash']),
+                     'Round': 'round-{}'.format(i + 1)})
+        t += rng.randint(3000, 5000)
+    return pandas.DataFrame(rows).sample(frac=1, random_state=rng.randint(0, 2**31))
+
+
+def emotionExport(rng, length=1):
+    rows = []
+    t = 20000
+    for i in range(30 * length):
+        response = rng.choice([2, 7, None])
+        row = {'ExperimentName': 'Emotion', 'FixationInput.OffsetTime': 10000, 'Stim.OnsetTime': t,
+               'Stim.OnsetToOnsetTime': 2000, 'Stim.RT': rng.randint(100, 900) if response else 0,
+               'jitter.OnsetTime': t + 2000, 'jitter.Duration': 1000, 'Stim.RESP': response or ' ',
+               'CorrectResponse': rng.choice([2, 7]) if i % 5 else ' ', 'Stim.ACC': rng.choice([0, 1]),
+               'BlkList': rng.randint(1, 10), 'Target': ' Angry ', 'Distraction': rng.choice(['Happy', ' ']),
+               'Ethnicity': rng.choice(['White ', ' ', 'Af Am']), 'Image': 'face{}.bmp'.format(i),
+               'Condition': 'A', 'Trial': i + 1, 'Block': i // 10 + 1}
+        row['Stim.RTTime'] = t + row['Stim.RT'] if response else 0
+        rows.append(row)
+        t += 3000
+    return pandas.DataFrame(rows)
+
+
+def feedbackExport(rng, length=1):
+    rows = []
+    t = 5000
+    for i in range(30 * length):
+        rt = rng.randint(100, 2000)
+        rows.append({'ExperimentName': 'Feedback', 'fix.OnsetTime': 1000,
+                     'Stim.OnsetTime': t if i != 4 else np.nan, # some onsets are missing
+                     'Stim.RT': rt, 'Stim.RTTime': t + rt, 'Anticipation.OnsetTime': t + 2500,
+                     'Feedback.OnsetTime': t + 4500, 'Feedback.Duration': 2000,
+                     'Feedbacktype': rng.choice(['Pos', 'Neg', 'Neut']), 'Category': 'C', 'LeftWord': 'a',
+                     'RightWord': 'b', 'Stim.RESP': rng.choice([2, 7, np.nan]), 'Trial': i + 1, 'Block': 1})
+        t += 7000
+    return pandas.DataFrame(rows)
+
+
+def teamExport(rng, length=1):
+    rows = []
+    t = 5000
+    for i in range(30 * length):
+        row = {'ExperimentName': 'Team', 'HereWeGo.Duration': 4000, 'HereWeGo.OnsetTime': 1000,
+               'Stim.OnsetTime': t, 'In1_Out2_C3': rng.choice([1, 2, 3]), 'Team': rng.choice(['red', 'blue']),
+               'Gender': 'F', 'Race': 'W', 'Image': 'p{}.jpg'.format(i), 'Trial': i + 1, 'Block': 1}
+        # response during the stimulus, during the jitter, or none
+        if i % 3 == 0:
+            row.update({'Stim.RESP': rng.randint(1, 4), 'Stim.RTTime': t + 500,
+                        'Jitter.RT': 0, 'Jitter.RTTime': 0, 'Jitter.RESP': np.nan})
+        elif i % 3 == 1:
+            row.update({'Stim.RESP': np.nan, 'Stim.RTTime': 0,
+                        'Jitter.RT': 200, 'Jitter.RTTime': t + 3200, 'Jitter.RESP': rng.randint(1, 4)})
+        else:
+            row.update({'Stim.RESP': np.nan, 'Stim.RTTime': 0, 'Jitter.RT': 0, 'Jitter.RTTime': 0, 'Jitter.RESP': np.nan})
+        rows.append(row)
+        t += 4000
+    return pandas.DataFrame(rows)
+
+
+def teamPreExport(rng, length=1):
+    rows = []
+    t = 5000
+    for i in range(20 * length):
+        rows.append({'ExperimentName': 'TeamPre', 'Stim.OnsetTime': t, 'Stim.RT': 500, 'Stim.RTTime': t + 500,
+                     'Stim.RESP': rng.choice(['p', 'q', np.nan]), 'CorrectAnswer': rng.choice(['p', 'q']),
+                     'LeftLabel': 'image/BlueTeam.png', 'RightLabel': 'image/RedTeam.png',
+                     'In1_Out2': rng.choice([1, 2]), 'Team': 'red', 'Gender': 'M', 'Race': rng.choice(['W', np.nan]),
+                     'Image': 'p{}.jpg'.format(i)})
+        t += 2000
+    return pandas.DataFrame(rows)
+
+
+def teamPostExport(rng, length=1):
+    # the two sample trials are recorded in every row
+    rows = []
+    t = 20000
+    for i in range(20 * length):
+        rows.append({'ExperimentName': 'TeamPost', 'PreSample1.OnsetTime': 1000, 'PreSample1.Duration': 1000,
+                     'PreSample2.OnsetTime': 6000, 'PreSample2.Duration': 1000, 'Sample1.OnsetTime': 2000,
+                     'Sample1.OffsetTime': 4000, 'Sample1.RT': 300, 'Sample1.RTTime': 2300, 'Sample1.RESP': 'p',
+                     'Sample2.OnsetTime': 7000, 'Sample2.OffsetTime': 9000, 'Sample2.RT': 400,
+                     'Sample2.RTTime': 7400, 'Sample2.RESP': 'q', 'PreStim.OnsetTime': t, 'PreStim.Duration': 500,
+                     'Trial': i + 1, 'Stim1.OnsetTime': t + 500, 'Stim1.OffsetTime': t + 2500, 'Stim1.RT': 600,
+                     'Stim1.RTTime': t + 1100, 'Stim1.RESP': rng.choice(['p', 'q', np.nan]),
+                     'CorrectAnswer': rng.choice(['p', 'q']), 'In1_Out2': rng.choice([1, 2]), 'Team': 'blue',
+                     'Gender': 'F', 'Race': 'A', 'Image': 'q{}.jpg'.format(i),
+                     'PhotoGroup': rng.choice(['1', '2', 'D']), 'IRI.OnsetTime': t + 2500, 'IRI.Duration': 1000})
+        t += 4000
+    return pandas.DataFrame(rows)
+
+
+# task name (as in convert_all) -> (export generator, column separator, encoding of most exports)
+EXPORTS = {
+    'cyberball': (cyberballExport, '\t', 'utf-16'),
+    'dotprobe': (dotprobeExport, '\t', 'utf-8'),
+    'driving': (drivingExport, ',', 'utf-8'),
+    'emotion': (emotionExport, '\t', 'utf-8'),
+    'feedback': (feedbackExport, '\t', 'utf-16'),
+    'gonogo': (gonogoExport, '\t', 'utf-16'),
+    'team': (teamExport, '\t', 'utf-8'),
+    'team-pre': (teamPreExport, '\t', 'utf-8'),
+    'team-post': (teamPostExport, '\t', 'utf-8'),
+}
+
+
+def writeExports(folder, tasks=None, subjects=3, length=1):
+    # writes <folder>/<task>/<task>_<subject ID>.txt for each task and returns the files by task
+    # every third subject uses the other encoding, as happened with the real exports
+    files = {}
+    for task in tasks or sorted(EXPORTS):
+        generate, sep, encoding = EXPORTS[task]
+        os.makedirs(join(folder, task), exist_ok=True)
+        files[task] = []
+        for s in range(subjects):
+            # seeded by task and subject so the same exports are written every time
+            rng = random.Random(zlib.crc32('{}{}'.format(task, s).encode()))
+            thisEncoding = encoding if s % 3 != 1 else ('utf-8' if encoding == 'utf-16' else 'utf-16')
+            datafile = join(folder, task, '{}_{}.txt'.format(task, 1000 + s))
+            generate(rng, length).to_csv(datafile, sep=sep, index=False, encoding=thisEncoding)
+            files[task].append(datafile)
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic ePrime exports for every task.')
+    parser.add_argument('folder', help='folder to write the exports to (one subfolder per task)')
+    parser.add_argument('tasks', nargs='*', metavar='task',
+                        help='tasks to write (default: all). One of: ' + ', '.join(sorted(EXPORTS)))
+    parser.add_argument('--subjects', type=int, default=3, help='number of exports per task')
+    parser.add_argument('--length', type=int, default=1,
+                        help='session length, as a multiple of the trials of a typical session')
+    args = parser.parse_args(argv)
+
+    unknown = [t for t in args.tasks if t not in EXPORTS]
+    if unknown:
+        parser.error('unknown task(s): ' + ', '.join(unknown))
+
+    files = writeExports(args.folder, args.tasks, args.subjects, args.length)
+    print('Wrote {} files.'.format(sum(len(f) for f in files.values())))
+
+
+if __name__ == '__main__':
+    main()
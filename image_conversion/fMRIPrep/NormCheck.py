@@ -4,26 +4,284 @@
 	#conda activate NormCheck
 	#cd ~/SNAP/Projects/fMRIPrep/katie/Code/
 	#python NormCheck.py filepath/filename1.nii.gz
-	
+
+#To check every BOLD and T1w image in one or more datasets and write a report (.csv or .json):
+	#python NormCheck.py --scan /mnt/magaj/SNAP/Data/BIDS/SNAP1/rawdata /mnt/magaj/SNAP/Data/BIDS/SNAP1/derivatives --report SNAP1_normcheck.csv
+
+#With --cache, results are kept in a file and reused for images whose path, size, modification time and inode
+#are unchanged, so a rerun only reads new or modified images. --since <report> only checks the images modified
+#after that (earlier) report was written:
+	#python NormCheck.py --scan .../rawdata .../derivatives --cache normcheck_cache.json --since SNAP1_normcheck.csv --report SNAP1_new.csv
+
+#--repair writes a copy of every affected image with the sform and qform deobliqued (as AFNI's 3drefit -deoblique):
+#each voxel axis is put along the nearest world axis, keeping the voxel sizes and the origin. Only the header changes;
+#the rest of the file is copied through block by block. The copy is named <name>.repaired.nii.gz next to the original,
+#unless --overwrite is given, which replaces the original once the repaired image is complete. Use --dry-run to only
+#report which images would be repaired.
+	#python NormCheck.py --scan .../derivatives --repair --dry-run --report SNAP1_repairs.csv
+	#python NormCheck.py --scan .../derivatives --repair --report SNAP1_repaired.csv
+
+import argparse
+import csv
+import json
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import nibabel as nb
+from nifti_header import readHeader, rewriteAffine
+
+# images checked by --scan, in rawdata and in the fMRIPrep derivatives
+SCAN_SUFFIXES = ('_bold.nii.gz', '_bold.nii', '_T1w.nii.gz', '_T1w.nii')
+REPORT_FIELDS = ['file', 'affected', 'severity', 'deviation', 'error', 'repair']
 
 
 def test(img):
-    zooms = np.array([img.header.get_zooms()[:3]])
-    A = img.affine[:3, :3]
-    
-    cosines = A / zooms
-    diff = A - cosines * zooms.T
+    #img is a nibabel image
+    return testAffine(img.header.get_zooms()[:3], img.affine)
 
-    return not np.allclose(diff, 0), np.max(np.abs(diff))
 
+def testAffine(zooms, affine):
+    affected, severity, diffs = testAffines(np.array([zooms[:3]]), np.array([affine[:3, :3]]))
+    return affected[0], severity[0]
 
-if __name__ == "__main__":
-    for fname in sys.argv[1:]:
-        affected, severity = test(nb.load(fname))
-        print(f"{fname} is affected ({severity=})")
-        if affected:
-            print(f"{fname} is affected ({severity=})")
 
+def testAffines(zooms, affines):
+    #the check of test() for N images at once: zooms is (N,3) and affines (N,3,3)
+    #returns the affected flags and severities, each (N,), and the (3,3) deviations of the affected images by index
+    zooms = np.asarray(zooms, dtype=np.float64)
+    A = np.asarray(affines, dtype=np.float64)[:, :3, :3]
+
+    cosines = A / zooms[:, np.newaxis, :]
+    diff = A - cosines * zooms[:, :, np.newaxis]
+
+    #as np.allclose(diff, 0) and np.max(np.abs(diff)) per image, so NaN counts as affected
+    deviation = np.abs(diff)
+    affected = ~np.all(deviation <= 1e-8, axis=(1, 2))
+    severity = deviation.max(axis=(1, 2))
+    return affected, severity, {i: diff[i] for i in np.flatnonzero(affected)}
+
+
+def uniquePaths(fnames):
+    # absolute paths, each once and in the order first given
+    return list(dict.fromkeys(os.path.abspath(fname) for fname in fnames))
+
+
+def findImages(folders):
+    # every BOLD and T1w image under the folders, once even if the folders overlap
+    images = []
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            images.extend(os.path.join(root, f) for f in sorted(files) if f.endswith(SCAN_SUFFIXES))
+    return uniquePaths(images)
+
+
+def readFile(fname):
+    # runs in a worker process; only the header is read (see nifti_header.py), never the voxel data
+    # an image that cannot be read is reported rather than stopping the scan
+    try:
+        zooms, affine = readHeader(fname)
+        return fname, zooms, affine[:3, :3], ''
+    except Exception as e:
+        return fname, None, None, str(e)
+
+
+def checkFiles(fnames, workers):
+    # the headers are read in parallel, then all affines are checked in one pass
+    if not fnames:
+        return []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        headers = list(executor.map(readFile, fnames, chunksize=64))
+
+    results = [{'file': fname, 'affected': None, 'severity': None, 'deviation': '', 'error': error}
+               for fname, zooms, affine, error in headers]
+    read = [i for i, (fname, zooms, affine, error) in enumerate(headers) if not error]
+    if read:
+        affected, severity, diffs = testAffines(np.stack([headers[i][1] for i in read]),
+                                                np.stack([headers[i][2] for i in read]))
+        for k, i in enumerate(read):
+            results[i]['affected'] = bool(affected[k])
+            results[i]['severity'] = float(severity[k])
+            if k in diffs:
+                results[i]['deviation'] = np.array2string(diffs[k], separator=',', precision=6).replace('\n', '')
+    return results
+
+
+def fileIdentity(fname):
+    # None for a missing file, which is then reported as unreadable
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def loadCache(cacheFile):
+    # absolute path -> {'identity': [size, mtime, inode], 'result': {...}}
+    if not os.path.exists(cacheFile):
+        return {}
+    with open(cacheFile) as f:
+        return json.load(f)
+
+
+def saveCache(cache, cacheFile):
+    # write to a temporary file first so an interrupted run cannot leave a truncated cache
+    tmpFile = cacheFile + '.tmp'
+    with open(tmpFile, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmpFile, cacheFile)
+
+
+def checkCached(fnames, workers, cache):
+    # results from the cache for images that have not changed, the others are checked and added to the cache
+    # images that could not be read are not cached, so they are tried again next time
+    identities = {fname: fileIdentity(fname) for fname in fnames}
+    results = {}
+    for fname in fnames:
+        entry = cache.get(os.path.abspath(fname))
+        if entry and identities[fname] and entry['identity'] == identities[fname]:
+            results[fname] = dict(entry['result'], file=fname)
+
+    nCached = len(results)
+    for result in checkFiles([f for f in fnames if f not in results], workers):
+        results[result['file']] = result
+        if not result['error']:
+            cache[os.path.abspath(result['file'])] = {'identity': identities[result['file']], 'result': result}
+    return [results[fname] for fname in fnames], nCached
+
+
+def deobliqued(affine):
+    #the affine with each voxel axis along the world axis nearest to it, keeping the voxel sizes and the origin
+    zooms = np.linalg.norm(affine[:3, :3], axis=0)
+    cosines = affine[:3, :3] / zooms
+    nearest = np.argmax(np.abs(cosines), axis=0)
+    if len(set(nearest)) < 3:
+        raise ValueError('two voxel axes are nearest to the same world axis')
+
+    axes = np.zeros((3, 3))
+    axes[nearest, np.arange(3)] = np.sign(cosines[nearest, np.arange(3)])
+    repaired = affine.copy()
+    repaired[:3, :3] = axes * zooms
+    return repaired
+
+
+def repairedName(fname):
+    #sub-01_bold.nii.gz -> sub-01_bold.repaired.nii.gz, which --scan does not pick up again
+    for ext in ('.nii.gz', '.nii'):
+        if fname.endswith(ext):
+            return fname[:-len(ext)] + '.repaired' + ext
+    return fname + '.repaired'
+
+
+def repairFile(fname, overwrite=False, dryRun=False):
+    # runs in a worker process; returns what was done, for the report
+    try:
+        zooms, affine = readHeader(fname)
+        repaired = deobliqued(affine)
+        if testAffine(np.linalg.norm(repaired[:3, :3], axis=0), repaired)[0]:
+            #voxel axes swapped between world axes with different voxel sizes: deobliquing is not enough
+            return 'not repaired: voxel axes are permuted'
+        if dryRun:
+            return 'would be repaired'
+        if overwrite:
+            rewriteAffine(fname, repaired)
+            return 'repaired'
+        output = repairedName(fname)
+        rewriteAffine(fname, repaired, output)
+        return f'repaired as {output}'
+    except Exception as e:
+        return f'not repaired: {e}'
+
+
+def writeReport(results, reportFile):
+    # JSON if the report file ends in .json, otherwise CSV
+    if reportFile.endswith('.json'):
+        with open(reportFile, 'w') as f:
+            json.dump(results, f, indent=1)
+    else:
+        with open(reportFile, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check NIfTI images for affines that do not match their voxel sizes.')
+    parser.add_argument('files', nargs='*', help='images to check')
+    parser.add_argument('--scan', nargs='+', default=[], metavar='FOLDER',
+                        help='also check every BOLD and T1w image under these folders (e.g. rawdata, derivatives)')
+    parser.add_argument('--report', default=None, help='write the results for every image to this .csv or .json file')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--cache', default=None,
+                        help='file keeping the results, reused for images that have not changed since')
+    parser.add_argument('--since', default=None, metavar='REPORT',
+                        help='only check scanned images modified after this file (e.g. the last report) was written')
+    parser.add_argument('--repair', action='store_true',
+                        help='write a copy of each affected image (<name>.repaired.nii.gz) '
+                             'with the sform and qform deobliqued')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='with --repair, replace the affected images instead of writing repaired copies')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='with --repair, only report which images would be repaired')
+    args = parser.parse_args(argv)
+    if (args.overwrite or args.dry_run) and not args.repair:
+        parser.error('--overwrite and --dry-run are options of --repair')
+
+    scanned = findImages(args.scan)
+    if args.since:
+        if not os.path.exists(args.since):
+            parser.error(f'{args.since} not found')
+        since = os.stat(args.since).st_mtime_ns
+        scanned = [fname for fname in scanned if os.stat(fname).st_mtime_ns > since]
+    #an image given and also scanned, or scanned twice, is checked (and repaired) only once
+    fnames = uniquePaths(args.files + scanned)
+    if not fnames and not args.since:
+        parser.error('no images given or found')
+
+    if args.cache:
+        cache = loadCache(args.cache)
+        results, nCached = checkCached(fnames, args.workers, cache)
+    else:
+        results, nCached = checkFiles(fnames, args.workers), 0
+    #every result has a repair entry; copied, so the cache keeps only what was checked
+    results = [dict(result, repair='') for result in results]
+
+    for result in results:
+        if result['error']:
+            print(f"{result['file']} could not be read ({result['error']})")
+        elif result['affected']:
+            severity = result['severity']
+            print(f"{result['file']} is affected ({severity=})")
+
+    nAffected = sum(1 for r in results if r['affected'])
+    nErrors = sum(1 for r in results if r['error'])
+    print(f"{len(results)} images checked ({nCached} unchanged, from the cache), {nAffected} affected, {nErrors} could not be read")
+
+    if args.repair:
+        toRepair = [r for r in results if r['affected']]
+        fnames = [r['file'] for r in toRepair]
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            outcomes = list(executor.map(repairFile, fnames, [args.overwrite] * len(fnames), [args.dry_run] * len(fnames)))
+        for result, outcome in zip(toRepair, outcomes):
+            result['repair'] = outcome
+            print(f"{result['file']} {outcome}")
+            if args.cache and args.overwrite and outcome == 'repaired':
+                #checked again next time
+                cache.pop(os.path.abspath(result['file']), None)
+        if args.dry_run:
+            nRepairable = outcomes.count('would be repaired')
+            print(f"{nRepairable} of {len(toRepair)} affected images would be repaired (dry run, nothing written)")
+        else:
+            nRepaired = sum(1 for outcome in outcomes if outcome.startswith('repaired'))
+            print(f"{nRepaired} of {len(toRepair)} affected images repaired")
+
+    if args.cache:
+        saveCache(cache, args.cache)
+
+    if args.report:
+        writeReport(results, args.report)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
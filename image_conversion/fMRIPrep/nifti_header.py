@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+#Reads the voxel sizes and the affine from the header of a NIfTI-1 or NIfTI-2 image (.nii or .nii.gz)
+#without loading the image. Only the header at the start of the file (348 or 540 bytes) is read, so
+#for a .nii.gz only the first block of the gzip stream is decompressed.
+#The affine is chosen as nibabel does: the sform if sform_code is set, otherwise the qform if
+#qform_code is set, otherwise the scaling affine from the voxel sizes.
+#rewriteAffine() writes a copy of an image (or replaces it) with a new sform and qform, copying the rest
+#of the file through in blocks, so the voxel data is never held in memory.
+
+import gzip
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+
+NIFTI1_SIZE = 348
+NIFTI2_SIZE = 540
+
+#offsets of the fields used here: dim, pixdim, qform_code, sform_code, quatern_b..qoffset_z, srow_x..srow_z
+#and the type of each (NIfTI-1 uses 16-bit ints and 32-bit floats, NIfTI-2 64-bit ints and doubles)
+LAYOUTS = {
+    NIFTI1_SIZE: {'dim': (40, 'h'), 'pixdim': (76, 'f'), 'qform_code': (252, 'h'), 'sform_code': (254, 'h'),
+                  'quatern': (256, 'f'), 'srow': (280, 'f')},
+    NIFTI2_SIZE: {'dim': (16, 'q'), 'pixdim': (104, 'd'), 'qform_code': (344, 'i'), 'sform_code': (348, 'i'),
+                  'quatern': (352, 'd'), 'srow': (400, 'd')},
+}
+FIELD_COUNTS = {'dim': 8, 'pixdim': 8, 'qform_code': 1, 'sform_code': 1, 'quatern': 6, 'srow': 12}
+
+#compression of rewritten .nii.gz files: the default of gzip and of most tools writing NIfTI images
+#(e.g. FSL, AFNI, fMRIPrep), so a rewritten image is about as small as its source
+COMPRESSLEVEL = 6
+
+
+def openImage(fname):
+    if fname.endswith('.gz'):
+        return gzip.open(fname, 'rb')
+    return open(fname, 'rb')
+
+
+def readRawHeader(fname):
+    #the header bytes and their byte order ('<' or '>'), found from sizeof_hdr
+    with openImage(fname) as f:
+        start = f.read(4)
+        for endian in '<>':
+            if len(start) == 4 and struct.unpack(endian + 'i', start)[0] in LAYOUTS:
+                size = struct.unpack(endian + 'i', start)[0]
+                raw = start + f.read(size - 4)
+                if len(raw) == size:
+                    return raw, endian
+    raise ValueError(f'{fname} is not a NIfTI-1 or NIfTI-2 image')
+
+
+def parseHeader(raw, endian):
+    fields = {}
+    for name, (offset, kind) in LAYOUTS[len(raw)].items():
+        fields[name] = np.array(struct.unpack_from(f'{endian}{FIELD_COUNTS[name]}{kind}', raw, offset),
+                                dtype=np.float64)
+    return fields
+
+
+def packFields(raw, endian, fields):
+    #the header bytes with the given fields replaced
+    raw = bytearray(raw)
+    for name, values in fields.items():
+        offset, kind = LAYOUTS[len(raw)][name]
+        if kind in 'hiq':
+            values = [int(v) for v in values]
+        struct.pack_into(f'{endian}{FIELD_COUNTS[name]}{kind}', raw, offset, *values)
+    return bytes(raw)
+
+
+def quaternionMatrix(b, c, d):
+    #rotation matrix of the unit quaternion (a, b, c, d), with a computed from b, c and d
+    a2 = 1.0 - (b * b + c * c + d * d)
+    a = np.sqrt(a2) if a2 > 0 else 0.0
+    n = a * a + b * b + c * c + d * d
+    if n < np.finfo(np.float64).eps:
+        return np.eye(3)
+    s = 2.0 / n
+    return np.array([
+        [1.0 - s * (c * c + d * d), s * (b * c - a * d), s * (b * d + a * c)],
+        [s * (b * c + a * d), 1.0 - s * (b * b + d * d), s * (c * d - a * b)],
+        [s * (b * d - a * c), s * (c * d + a * b), 1.0 - s * (b * b + c * c)],
+    ])
+
+
+def rotationQuaternion(R):
+    #(b, c, d) of the unit quaternion of a rotation matrix, with a >= 0 as the qform requires
+    #the inverse of quaternionMatrix()
+    t = np.trace(R)
+    if t > 0:
+        s = np.sqrt(t + 1.0) * 2
+        a, b, c, d = s / 4, (R[2, 1] - R[1, 2]) / s, (R[0, 2] - R[2, 0]) / s, (R[1, 0] - R[0, 1]) / s
+    elif R[0, 0] > R[1, 1] and R[0, 0] > R[2, 2]:
+        s = np.sqrt(1.0 + R[0, 0] - R[1, 1] - R[2, 2]) * 2
+        a, b, c, d = (R[2, 1] - R[1, 2]) / s, s / 4, (R[0, 1] + R[1, 0]) / s, (R[0, 2] + R[2, 0]) / s
+    elif R[1, 1] > R[2, 2]:
+        s = np.sqrt(1.0 + R[1, 1] - R[0, 0] - R[2, 2]) * 2
+        a, b, c, d = (R[0, 2] - R[2, 0]) / s, (R[0, 1] + R[1, 0]) / s, s / 4, (R[1, 2] + R[2, 1]) / s
+    else:
+        s = np.sqrt(1.0 + R[2, 2] - R[0, 0] - R[1, 1]) * 2
+        a, b, c, d = (R[1, 0] - R[0, 1]) / s, (R[0, 2] + R[2, 0]) / s, (R[1, 2] + R[2, 1]) / s, s / 4
+    if a < 0:
+        b, c, d = -b, -c, -d
+    return b, c, d
+
+
+def affineFields(fields, affine):
+    #sform, qform and voxel sizes for an affine whose first three columns are a rotation (or a rotation
+    #with a flip) times the voxel sizes; the qform codes a flip of the third axis in pixdim[0] (qfac)
+    zooms = np.linalg.norm(affine[:3, :3], axis=0)
+    R = affine[:3, :3] / zooms
+    qfac = 1.0
+    if np.linalg.det(R) < 0:
+        R[:, 2] *= -1
+        qfac = -1.0
+    pixdim = fields['pixdim'].copy()
+    pixdim[0] = qfac
+    pixdim[1:4] = zooms
+    return {'srow': affine[:3, :].ravel(), 'quatern': [*rotationQuaternion(R), *affine[:3, 3]], 'pixdim': pixdim}
+
+
+def rewriteAffine(fname, affine, output=None, blocksize=1 << 20):
+    #writes the image to output (by default replacing fname) with the affine in its sform and qform
+    #(keeping their codes), copying the rest of the file through unchanged, block by block. The new
+    #file is written under a temporary name and then renamed, so output is never left half written.
+    output = output or fname
+    raw, endian = readRawHeader(fname)
+    newRaw = packFields(raw, endian, affineFields(parseHeader(raw, endian), affine))
+
+    #a temporary name no other rewrite can be using, even one of the same image
+    folder, name = os.path.split(os.path.abspath(output))
+    fd, tmpFile = tempfile.mkstemp(prefix='.' + name + '.', suffix='.tmp', dir=folder)
+    os.close(fd)
+    try:
+        if fname.endswith('.gz'):
+            with gzip.open(fname, 'rb') as src, open(tmpFile, 'wb') as f, \
+                    gzip.GzipFile(name[:-3], 'wb', COMPRESSLEVEL, f) as dst:
+                src.read(len(raw))
+                dst.write(newRaw)
+                shutil.copyfileobj(src, dst, blocksize)
+        else:
+            shutil.copyfile(fname, tmpFile)
+            with open(tmpFile, 'r+b') as dst:
+                dst.write(newRaw)
+
+        st = os.stat(fname)
+        shutil.copymode(fname, tmpFile)
+        try:
+            os.chown(tmpFile, st.st_uid, st.st_gid)
+        except PermissionError:
+            #only root can give the file away; it then belongs to whoever repaired it
+            pass
+        os.replace(tmpFile, output)
+    finally:
+        if os.path.exists(tmpFile):
+            os.remove(tmpFile)
+
+
+def spatialShape(fields):
+    #size of the first three dimensions, 1 for those the image does not have
+    ndim = int(fields['dim'][0])
+    return np.where(np.arange(1, 4) <= ndim, fields['dim'][1:4], 1.0)
+
+
+def spatialZooms(fields):
+    #voxel sizes of the first three dimensions, 1 for those the image does not have
+    ndim = int(fields['dim'][0])
+    return np.where(np.arange(1, 4) <= ndim, fields['pixdim'][1:4], 1.0)
+
+
+def headerAffine(fields):
+    if fields['sform_code'][0] != 0:
+        return np.vstack([fields['srow'].reshape(3, 4), [0, 0, 0, 1]])
+
+    pixdim = fields['pixdim']
+    affine = np.eye(4)
+    if fields['qform_code'][0] != 0:
+        b, c, d, qx, qy, qz = fields['quatern']
+        qfac = -1.0 if pixdim[0] < 0 else 1.0
+        affine[:3, :3] = quaternionMatrix(b, c, d) * np.array([pixdim[1], pixdim[2], pixdim[3] * qfac])
+        affine[:3, 3] = qx, qy, qz
+    else:
+        #no orientation stored: voxel sizes only, with the center of the image at the origin
+        zooms, shape = spatialZooms(fields), spatialShape(fields)
+        affine[:3, :3] = np.diag([-zooms[0], zooms[1], zooms[2]])
+        affine[:3, 3] = (shape - 1) / 2.0 * zooms * [1, -1, -1]
+    return affine
+
+
+def readHeader(fname):
+    #voxel sizes of the first three dimensions and the 4x4 affine
+    raw, endian = readRawHeader(fname)
+    fields = parseHeader(raw, endian)
+    return spatialZooms(fields), headerAffine(fields)